@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
-import sys, os, subprocess, shutil, gzip, csv, argparse, fcntl
+import sys, os, re, subprocess, shutil, gzip, csv, argparse, fcntl
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
+GUNZIP_BUFSIZE = 4 * 1024 * 1024
+BATCH_LINE_RE = re.compile(r"^[ \t]*(t1|template_dir) =.*$", re.MULTILINE)
+# An uncommented spm_jobman('run', ...) call: the batch runs its own jobs when evaluated
+SELF_RUNNING_BATCH_RE = re.compile(r"^[^%\n]*\bspm_jobman\s*\(\s*'run'", re.MULTILINE)
+
 def clean_stem(p: Path) -> str:
     stem = p.name
     if stem.endswith(".nii.gz"):
@@ -10,48 +17,152 @@ def clean_stem(p: Path) -> str:
         stem = stem[:-4]
     return stem
 
+def is_t1_path(arg):
+    """Whether a positional argument names a T1 image rather than a directory"""
+    return arg.endswith((".nii", ".nii.gz")) or os.path.isfile(arg)
+
 def gunzip_nii_gz(src, dst):
-    """Uncompress .nii.gz -> .nii"""
+    """Uncompress .nii.gz -> .nii using one reusable 4 MiB buffer"""
+    buf = memoryview(bytearray(GUNZIP_BUFSIZE))
     with gzip.open(src, 'rb') as f_in, open(dst, 'wb') as f_out:
-        shutil.copyfileobj(f_in, f_out)
-
-def append_to_shared_csv(out_csv, stem, prediction_csv):
-    """Append results from prediction_csv into a shared out_csv with file lock"""
+        n = f_in.readinto(buf)
+        while n:
+            f_out.write(buf[:n])
+            n = f_in.readinto(buf)
+
+@lru_cache(maxsize=1)
+def read_batch_template(path):
+    """Read the SPM12 batch template once per process"""
+    with open(path, "r") as f:
+        return f.read()
+
+def matlab_quote(text):
+    """Escape text for use inside a single-quoted MATLAB string"""
+    return text.replace("'", "''")
+
+def patch_batch(template, stem, templates_src):
+    """Point the t1 and template_dir assignments of a batch template at stem"""
+    lines = {
+        "t1": f"t1 = './{matlab_quote(stem)}.nii';",
+        "template_dir": f"template_dir = '{matlab_quote(templates_src)}/';",
+    }
+    return BATCH_LINE_RE.sub(lambda m: lines[m.group(1)], template)
+
+def read_prediction_row(prediction_csv, stem):
+    """Read the header and the single result row of a per-subject prediction"""
     with open(prediction_csv, newline="") as infile:
         reader = csv.reader(infile)
         header = next(reader)
         row = next(reader)
         row[0] = stem
+    return header, row
 
+def append_to_shared_csv(out_csv, header, rows):
+    """Append rows to a shared out_csv, taking the file lock once per run"""
     file_exists = os.path.exists(out_csv)
     with open(out_csv, "a+", newline="") as f:
         fcntl.flock(f, fcntl.LOCK_EX)
         writer = csv.writer(f)
         if not file_exists:
             writer.writerow(header)
-        writer.writerow(row)
+        writer.writerows(rows)
         fcntl.flock(f, fcntl.LOCK_UN)
 
+def prepare_subject(input_t1, out_root, batch_template, templates_src):
+    """Create out_root/stem with a patched batch file and the T1 as stem.nii"""
+    stem = clean_stem(Path(input_t1))
+
+    # Workdir is out_root/stem
+    workdir = os.path.join(out_root, stem)
+    os.makedirs(workdir, exist_ok=True)
+
+    # Copy and patch batch file
+    batch_copy = os.path.join(workdir, "brainager_batch.m")
+    with open(batch_copy, "w") as f_out:
+        f_out.write(patch_batch(read_batch_template(batch_template), stem, templates_src))
+
+    # Prepare T1 file as stem.nii
+    t1_dst = os.path.join(workdir, f"{stem}.nii")
+    if input_t1.endswith(".nii.gz"):
+        gunzip_nii_gz(input_t1, t1_dst)
+    elif input_t1.endswith(".nii"):
+        shutil.copy2(input_t1, t1_dst)
+    else:
+        sys.exit("ERROR: Input must be .nii or .nii.gz")
+
+    print(f"[INFO] Working directory: {workdir}")
+    return stem, workdir, batch_copy
+
+def runs_own_jobs(template):
+    """Whether a batch template runs its jobs itself when evaluated"""
+    return SELF_RUNNING_BATCH_RE.search(template) is not None
+
+def write_cohort_batch(out_root, subjects, run_jobs):
+    """Chain the per-subject batches into one script so MCR starts only once.
+
+    The standalone evaluates the script text, so each subject's batch is
+    preceded by a cd into its workdir to keep the relative t1 path valid,
+    and by clearing matlabbatch so no job of the previous copy is rerun.
+    With run_jobs, for templates that only fill matlabbatch, each copy is
+    followed by an spm_jobman run of its jobs, and the batch is cleared at
+    the end so the last copy is not run a second time.
+    """
+    cohort_batch = os.path.join(out_root, "brainager_batch_cohort.m")
+    with open(cohort_batch, "w") as f_out:
+        for _, workdir, batch_copy in subjects:
+            f_out.write(f"cd('{matlab_quote(workdir)}');\nclear matlabbatch;\n")
+            with open(batch_copy, "r") as f_in:
+                f_out.write(f_in.read())
+            f_out.write("\n")
+            if run_jobs:
+                f_out.write("spm_jobman('run', matlabbatch);\n")
+        if run_jobs:
+            f_out.write("clear matlabbatch;\n")
+    return cohort_batch
+
+def predict_subject(script_dir, stem, workdir):
+    """Run predict_age.py for one segmented subject and return its CSV row"""
+    # Call predict_age.py with subjname
+    predict_script = os.path.join(script_dir, "predict_age.py")
+    subprocess.run([sys.executable, predict_script, workdir, "--subjname", f"{stem}.nii"], check=True)
+
+    prediction_csv = os.path.join(workdir, "brainage_prediction.csv")
+    if not os.path.exists(prediction_csv):
+        sys.exit("ERROR: Prediction CSV not found")
+
+    return read_prediction_row(prediction_csv, stem)
+
 def main():
     parser = argparse.ArgumentParser(description="BrainageR segmentation + prediction wrapper")
-    parser.add_argument("t1", help="Input T1 image (.nii or .nii.gz)")
-    parser.add_argument("outdir", nargs="?", default=None, help="Output directory (default: script dir)")
+    parser.add_argument("t1", nargs="+",
+                        help="Input T1 image(s) (.nii or .nii.gz). All inputs are segmented "
+                             "in a single SPM12 run. Without -o, a second argument that is not "
+                             "an existing file or a .nii/.nii.gz path is read as the output "
+                             "directory, as in earlier versions.")
+    parser.add_argument("-o", "--outdir", default=None, help="Output directory (default: script dir)")
     parser.add_argument("--delete-temp", action="store_true", help="Delete temporary folder (default: keep)")
     args = parser.parse_args()
 
+    inputs, outdir = args.t1, args.outdir
+    if outdir is None and len(inputs) == 2 and not is_t1_path(inputs[1]):
+        # Former 't1 [outdir]' usage
+        inputs, outdir = inputs[:1], inputs[1]
+
     if shutil.which("run_spm12.sh") is None:
         sys.exit("ERROR: 'run_spm12.sh' not found. 'ml spm12'\n")
 
-    # Input T1
-    input_t1 = os.path.abspath(args.t1)
-    if not os.path.exists(input_t1):
-        sys.exit(f"ERROR: T1 file not found: {input_t1}")
-
-    stem = clean_stem(Path(input_t1))
+    # Input T1s
+    input_t1s = [os.path.abspath(t1) for t1 in inputs]
+    for input_t1 in input_t1s:
+        if not os.path.exists(input_t1):
+            sys.exit(f"ERROR: T1 file not found: {input_t1}")
+    stems = [clean_stem(Path(t1)) for t1 in input_t1s]
+    if len(set(stems)) != len(stems):
+        sys.exit("ERROR: Input T1 file names must be unique")
 
     # Output root directory
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    out_root = os.path.abspath(args.outdir) if args.outdir else script_dir
+    out_root = os.path.abspath(outdir) if outdir else script_dir
     os.makedirs(out_root, exist_ok=True)
 
     # Locate batch template and templates folder
@@ -62,32 +173,17 @@ def main():
     if not os.path.isdir(templates_src):
         sys.exit(f"ERROR: templates folder not found in {script_dir}")
 
-    # Workdir is out_root/stem
-    workdir = os.path.join(out_root, stem)
-    os.makedirs(workdir, exist_ok=True)
-
-    # Copy and patch batch file
-    batch_copy = os.path.join(workdir, "brainager_batch.m")
-    with open(batch_template, "r") as f_in, open(batch_copy, "w") as f_out:
-        for line in f_in:
-            if line.strip().startswith("t1 ="):
-                f_out.write(f"t1 = './{stem}.nii';\n")
-            elif line.strip().startswith("template_dir ="):
-                f_out.write(f"template_dir = '{templates_src}/';\n")
-            else:
-                f_out.write(line)
+    # Decompress/copy the inputs concurrently; zlib releases the GIL, so the
+    # gunzips of a cohort overlap instead of running back to back
+    workers = min(len(input_t1s), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        subjects = list(pool.map(lambda t1: prepare_subject(t1, out_root, batch_template, templates_src), input_t1s))
 
-    # Prepare T1 file as stem.nii
-    t1_dst = os.path.join(workdir, f"{stem}.nii")
-    if input_t1.endswith(".nii.gz"):
-        gunzip_nii_gz(input_t1, t1_dst)
-    elif input_t1.endswith(".nii"):
-        shutil.copy2(input_t1, t1_dst)
+    if len(subjects) > 1:
+        run_jobs = not runs_own_jobs(read_batch_template(batch_template))
+        spm_cwd, spm_batch = out_root, write_cohort_batch(out_root, subjects, run_jobs)
     else:
-        sys.exit("ERROR: Input must be .nii or .nii.gz")
-
-    print(f"[INFO] Working directory: {workdir}")
-    print(f"[INFO] Running SPM12 with T1: {t1_dst}")
+        _, spm_cwd, spm_batch = subjects[0]
 
     # Run spm12 standalone. The deployed SPM12 build in this recipe uses the
     # R2017b MCR; preloading system FreeType avoids the MCR-bundled library
@@ -95,30 +191,28 @@ def main():
     spm_env = os.environ.copy()
     spm_env["LD_PRELOAD"] = "/usr/lib/x86_64-linux-gnu/libfreetype.so.6"
     mcr_root = os.environ.get("MCRROOT", "/opt/mcr/v93")
-    cmd = ["run_spm12.sh", mcr_root, "script", batch_copy]
-    subprocess.run(cmd, check=True, cwd=workdir, env=spm_env)
+    print(f"[INFO] Running SPM12 on {len(subjects)} T1 image(s) with batch: {spm_batch}")
+    cmd = ["run_spm12.sh", mcr_root, "script", spm_batch]
+    subprocess.run(cmd, check=True, cwd=spm_cwd, env=spm_env)
 
     print(f"[INFO] SPM12 finished, now running prediction")
 
-    # Call predict_age.py with subjname
-    predict_script = os.path.join(script_dir, "predict_age.py")
-    subprocess.run([sys.executable, predict_script, workdir, "--subjname", f"{stem}.nii"], check=True)
-
-    # Append results to shared CSV
-    prediction_csv = os.path.join(workdir, "brainage_prediction.csv")
-    if not os.path.exists(prediction_csv):
-        sys.exit("ERROR: Prediction CSV not found")
+    # Each prediction writes its own CSV in its workdir, so subjects can run
+    # concurrently; the shared CSV is appended once with all rows afterwards
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda subject: predict_subject(script_dir, *subject[:2]), subjects))
 
     out_csv = os.path.join(out_root, "brainage_prediction.csv")
-    append_to_shared_csv(out_csv, stem, prediction_csv)
+    append_to_shared_csv(out_csv, results[0][0], [row for _, row in results])
 
-    print(f"[INFO] Appended result for {stem} to {out_csv}")
+    print(f"[INFO] Appended {len(results)} result(s) to {out_csv}")
 
-    if args.delete_temp:
-        shutil.rmtree(workdir)
-        print(f"[INFO] Deleted temp folder: {workdir}")
-    else:
-        print(f"[INFO] Temp folder kept: {workdir}")
+    for _, workdir, _ in subjects:
+        if args.delete_temp:
+            shutil.rmtree(workdir)
+            print(f"[INFO] Deleted temp folder: {workdir}")
+        else:
+            print(f"[INFO] Temp folder kept: {workdir}")
 
 if __name__ == "__main__":
     main()
@@ -7,6 +7,7 @@ import mrdhelper
 import constants
 import nibabel as nib
 import subprocess
+from functools import lru_cache
 
 from skimage.segmentation import find_boundaries
 import SimpleITK as sitk
@@ -148,8 +149,8 @@ def process_image(images, connection, config, metadata):
 
     # Note: The MRD Image class stores data as [cha z y x]
 
-    # Extract image data into a 5D array of size [img cha z y x]
-    data = np.stack([img.data                              for img in images])
+    # Image data is copied straight from each image into the 4D volume
+    # below, so it is not stacked into a [img cha z y x] array first
     head = [img.getHead()                                  for img in images]
     meta = [ismrmrd.Meta.deserialize(img.attribute_string) for img in images]
 
@@ -167,20 +168,19 @@ def process_image(images, connection, config, metadata):
     logging.info(f'MRD phase_dir        [x y z] : {phase_dir}')
     logging.info(f'MRD slice_dir        [x y z] : {slice_dir}')
 
-    logging.debug("Original image data before transposing is %s" % (data.shape,))
-    
-    # Transpose to [x y img z cha] and keep only [x y img]
-    # It looks like MRD images might be [img cha z x y]
-    data = data.transpose((3, 4, 0, 2, 1))
-    data = np.squeeze(data[..., 0, 0])
+    logging.debug("Original image data is %d images of %s" % (len(images), images[0].data.shape))
 
-    logging.debug("Original image data after transposing is %s" % (data.shape,))
+    # Only the 2D plane of the first channel and partition of each image is
+    # used
+    n_rows, n_cols = images[0].data.shape[-2:]
 
     # Turn into 4D fMRI data
     n_slices = np.unique([img.slice for img in images]).shape[0]
     n_repetitions = np.unique([img.repetition for img in images]).shape[0]
     # New data with the correct 4D dimensions
-    new_data = np.zeros((data.shape[0], data.shape[1], n_slices, n_repetitions))
+    # Float32 in Fortran order, which is the layout NIfTI stores, so each
+    # 2D image below fills a contiguous slab and saving needs no reordering
+    new_data = np.zeros((n_rows, n_cols, n_slices, n_repetitions), dtype=np.float32, order='F')
     
     # Determine order for stacking when returning images
     slices = [img.slice for img in images]
@@ -228,16 +228,26 @@ def process_image(images, connection, config, metadata):
     logging.debug("Voxel size from metadata: %s" % (meta_voxelsize,))
     logging.debug("Voxel size from FoV: %s" % (voxelsize,))
 
+    # Uncompressed .nii, so the volume is written out as a single buffer
     new_img = nib.nifti1.Nifti1Image(data, affine=affine)
-    nib.save(new_img, 'nifti_from_h5.nii')
+    new_img.set_data_dtype(np.float32)
+    new_img.to_filename('nifti_from_h5.nii')
     logging.info('Saved NIfTI image for AFNI processing')
 
     ## WRITE AFNI SCRIPTS HERE!!!!
     logging.info('Running AFNI processing')
-    subprocess.run(["/opt/code/afni_processing.sh", "--input", "nifti_from_h5.nii", "--output", "output_afni"])
+    # Let AFNI's OpenMP programs use every CPU this process may run on, with
+    # threads kept close to their cores, unless the site already set these
+    n_threads = len(os.sched_getaffinity(0))
+    afni_env = os.environ.copy()
+    afni_env.setdefault("OMP_NUM_THREADS", str(n_threads))
+    afni_env.setdefault("OMP_PROC_BIND", "close")
+    afni_env.setdefault("OMP_PLACES", "cores")
+    subprocess.run(["/opt/code/afni_processing.sh", "--input", "nifti_from_h5.nii", "--output", "output_afni",
+                    "--n-threads", afni_env["OMP_NUM_THREADS"]], env=afni_env, check=True)
 
     logging.info('Running image transformation for showing stats')
-    stat_labels, stat_img = show_stats('output_afni/output_image.nii', 'output_afni/stats.nii')
+    stat_labels, stat_data = show_stats('output_afni/output_image.nii', 'output_afni/stats.nii')
 
     logging.info("Config: \n%s", config)
 
@@ -246,19 +256,22 @@ def process_image(images, connection, config, metadata):
     logging.info('Loading Output image')
     # data_img = nib.load('output_image.nii')
     # data = data_img.get_fdata()
-    stat_data = stat_img.get_fdata()
     data = np.concatenate([stat_data, data], axis=-1)
     logging.info("Output image data shape before transposing: %s", data.shape)
 
     # The output is 4D image with the 4th dimension being different
-    # stats maps and repetitions. Transpose it to [cha x y rep slice]
-    # for easier reslicing into 2D images. Follow the pattern the
-    # images came in - all slices of one rep/stat then all slices of
-    # the next rep/stat, etc.
-    data = data[:, :, :, :, None]
-    data = data.transpose((4, 0, 1, 3, 2))
-    n_slices = data.shape[-1]
-    n_reps  = data.shape[-2]  # includes number of stats maps as well
+    # stats maps and repetitions. Reorder it once into a contiguous
+    # [img z x y] array in the order the 2D images are sent back, so each
+    # output image below is a contiguous slab. Follow the pattern the
+    # images came in - all slices of one rep/stat then all slices of the
+    # next rep/stat, etc.
+    n_slices = data.shape[2]
+    n_reps   = data.shape[3]  # includes number of stats maps as well
+    if orderinfo == 'slices':
+        out_order = (3, 2, 0, 1)
+    else:
+        out_order = (2, 3, 0, 1)
+    data = np.ascontiguousarray(data.transpose(out_order)).reshape((n_reps * n_slices, 1) + data.shape[:2])
     logging.info("Output image data shape: %s", data.shape)
 
     # Determine max value (12 or 16 bit)
@@ -267,10 +280,11 @@ def process_image(images, connection, config, metadata):
     #     BitsStored = mrdhelper.get_userParameterLong_value(metadata, "BitsStored")
     maxVal = 2**BitsStored - 1
 
-    # Normalize Data and convert to int16
-    data = data.astype(np.float64)
+    # Normalize Data and convert to int16. The concatenated array is owned
+    # here, so scale and round it in place and only allocate the int16 output
+    data = data.astype(np.float32, copy=False)
     data *= maxVal/data.max()
-    data = np.around(data)
+    np.around(data, out=data)
     data = data.astype(np.int16)
 
     currentSeries = 0
@@ -281,14 +295,12 @@ def process_image(images, connection, config, metadata):
         outer_range = range(n_reps)
         inner_range = range(n_slices)
         get_idx = lambda i, j: j + i * n_slices
-        get_data = lambda data, i, j: data[..., i, j]
         get_rep = lambda i, j: i
     else:
         # Stack all repetitions of slice 0, then all repetitions of slice 1, etc
         outer_range = range(n_slices)
         inner_range = range(n_reps)
         get_idx = lambda i, j: j + i * n_reps
-        get_data = lambda data, i, j: data[..., j, i]
         get_rep = lambda i, j: j
 
     # Re-slice image data back into 2D images
@@ -305,7 +317,7 @@ def process_image(images, connection, config, metadata):
             # with this option, can take input as: [cha z y x], [z y x], or [y x]
             # imagesOut[iImg] = ismrmrd.Image.from_array(data[...,iImg].transpose((3, 2, 0, 1)), transpose=False)
             # imagesOut[iImg] = ismrmrd.Image.from_array(data[...,iImg].transpose((3, 2, 0, 1)), transpose=False)
-            imagesOut[img_idx] = ismrmrd.Image.from_array(get_data(data, i, j), transpose=False)
+            imagesOut[img_idx] = ismrmrd.Image.from_array(data[img_idx], transpose=False)
             # outputOut[iImg] = ismrmrd.Image.from_array(data[...,iImg].transpose((3, 2, 0, 1)), transpose=False)
 
             # Create a copy of the original fixed header and update the data_type
@@ -343,10 +355,10 @@ def process_image(images, connection, config, metadata):
 
             # Add image orientation directions to MetaAttributes if not already present
             if tmpMeta.get('ImageRowDir') is None:
-                tmpMeta['ImageRowDir'] = ["{:.18f}".format(oldHeader.read_dir[0]), "{:.18f}".format(oldHeader.read_dir[1]), "{:.18f}".format(oldHeader.read_dir[2])]
+                tmpMeta['ImageRowDir'] = list(format_direction(tuple(oldHeader.read_dir)))
 
             if tmpMeta.get('ImageColumnDir') is None:
-                tmpMeta['ImageColumnDir'] = ["{:.18f}".format(oldHeader.phase_dir[0]), "{:.18f}".format(oldHeader.phase_dir[1]), "{:.18f}".format(oldHeader.phase_dir[2])]
+                tmpMeta['ImageColumnDir'] = list(format_direction(tuple(oldHeader.phase_dir)))
 
             metaXml = tmpMeta.serialize()
             # logging.debug("Image MetaAttributes: %s", xml.dom.minidom.parseString(metaXml).toprettyxml())
@@ -357,10 +369,20 @@ def process_image(images, connection, config, metadata):
     return imagesOut
 
 
-def show_stats(img_path, stats_img_path, output_path='./'):
+@lru_cache(maxsize=None)
+def format_direction(direction):
+    # Images of a group normally share their read/phase directions, so each
+    # distinct direction is only formatted once
+    return tuple("{:.18f}".format(v) for v in direction)
+
+
+def show_stats(img_path, stats_img_path, output_path=None):
+    # The thresholded maps are returned as an array for process_image; they
+    # are only written to output_path/output_image.nii when a path is given
+    # Read only the volumes that are used, as float32 rather than the
+    # float64 that get_fdata() would cache for the whole file
     img = nib.load(img_path)
-    data = img.get_fdata()
-    data = data[..., 0]
+    data = np.asarray(img.dataobj[..., 0], dtype=np.float32)
     norm_data = normalise_data(data)
 
     # Set threshold for showing voxels
@@ -374,8 +396,7 @@ def show_stats(img_path, stats_img_path, output_path='./'):
     logging.info(f'Normalized data to range: {norm_data.min():.2f} - {norm_data.max():.2f}')
 
     stats_img = nib.load(stats_img_path)
-    stats_data = stats_img.get_fdata()
-    stats_data = stats_data[..., 0, :]
+    stats_data = np.asarray(stats_img.dataobj[..., 0, :], dtype=np.float32)
 
     # Get stats labels from AFNI.
     result = subprocess.run(
@@ -387,48 +408,63 @@ def show_stats(img_path, stats_img_path, output_path='./'):
     )
     labels = result.stdout.strip().split('|')
     logging.info(f'Labels: {labels}')
+    label_idx = {lab: i for i, lab in enumerate(labels)}
 
     # Create pairs of coefficients and their t-stat values.
     coefs_stats = []
     for lab in labels:
         if 'Tstat' in lab:
-            coef = [ii for ii in labels if ii == lab.replace('Tstat', 'Coef')]
-            if len(coef) != 1:
-                print(f'Found wrong number of coefficients: {len(coef)}')
-            coef = coef[0]
+            coef = lab.replace('Tstat', 'Coef')
+            if coef not in label_idx:
+                logging.warning(f'No coefficient found for {lab}')
+                continue
             coefs_stats.append((coef, lab))
 
     logging.info(f'Coef & Tstat pairs: {coefs_stats}')
 
-    output_data = []
+    # Fill one output volume per pair up front instead of copying the
+    # normalised data for every label and stacking the copies afterwards
+    output_data = np.empty(norm_data.shape + (len(coefs_stats),), dtype=norm_data.dtype)
+    output_data[...] = norm_data[..., None]
     output_labels = []
-    for coef_label, tstat_label in coefs_stats:
-        coef_idx = labels.index(coef_label)
-        stat_idx = labels.index(tstat_label)
+    for i, (coef_label, tstat_label) in enumerate(coefs_stats):
+        coef_idx = label_idx[coef_label]
+        stat_idx = label_idx[tstat_label]
 
         # Find all data that have coefficients above a certain threshold
         #  (top 20% for example) and set their values to above the max value
         # of the normalised data.
-        current_stats_data = np.squeeze(stats_data[..., stat_idx])
-        thresh = np.quantile(current_stats_data, 0.9)
+        current_stats_data = stats_data[..., stat_idx]
+        thresh = quantile_threshold(current_stats_data, 0.9)
 
-        above_idx = current_stats_data >= thresh
-        data_copy = norm_data.copy()
-        data_copy[above_idx] = 1.1
-        output_data.append(data_copy)
+        np.copyto(output_data[..., i], 1.1, where=current_stats_data >= thresh)
         output_labels.append(f'{coef_label}_thresh90')
 
-    output_data = np.stack(output_data, axis=-1)
-    output_img = nib.nifti1.Nifti1Image(output_data, img.affine)
-    nib.save(output_img, os.path.join(output_path, 'output_image.nii'))
+    if output_path is not None:
+        output_img = nib.nifti1.Nifti1Image(output_data, img.affine)
+        nib.save(output_img, os.path.join(output_path, 'output_image.nii'))
+
+    return output_labels, output_data
+
 
-    return output_labels, output_img
+def quantile_threshold(data, q):
+    # Same linear interpolation as np.quantile, but only the two order
+    # statistics around the requested quantile are selected
+    flat = data.ravel()
+    pos = q * (flat.size - 1)
+    lo = int(pos)
+    hi = min(lo + 1, flat.size - 1)
+    ordered = np.partition(flat, (lo, hi))
+    return ordered[lo] + (pos - lo) * (ordered[hi] - ordered[lo])
 
 
 def normalise_data(data):
     min_val = np.min(data)
     max_val = np.max(data)
-    normalized_data = (data - min_val) / (max_val - min_val)
+    # Subtract into a single new buffer and scale it in place, rather than
+    # allocating a second full-volume temporary for the division
+    normalized_data = np.subtract(data, min_val)
+    normalized_data /= (max_val - min_val)
 
     return normalized_data
 
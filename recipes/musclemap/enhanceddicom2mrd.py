@@ -1,12 +1,19 @@
 import pydicom
+from pydicom.dataelem import RawDataElement
+from pydicom.multival import MultiValue
+from pydicom.uid import EnhancedMRImageStorage
 import argparse
 import ismrmrd
 import ismrmrd.xsd
+import ismrmrd.hdf5
+import h5py
 import numpy as np
 import os
 import ctypes
 import re
 import base64
+import collections
+import concurrent.futures
 
 # Direction vectors (read_dir, phase_dir, slice_dir) and position are stored
 # in DICOM's LPS patient coordinate system (x=Left, y=Posterior, z=Superior).
@@ -39,40 +46,104 @@ venc_dir_map = {'rl'  : 'FLOW_DIR_R_TO_L',
                 'in'  : 'FLOW_DIR_TP_IN',
                 'out' : 'FLOW_DIR_TP_OUT'}
 
+# Siemens flow sequence names end in _v<velocity><direction>, e.g. fl2d1_v150in
+venc_re = re.compile(r'_v(\d+)([^\d]*)$')
+
+# DICOM TM values: HHMMSS with optional fractional seconds
+acq_time_re = re.compile(r'(\d{2})(\d{2})(\d{2})(\.\d+)?$')
+
+
+def _get_ds(dset, keyword):
+    """Get a decimal string (DS) element as a float array, or None if it is absent or empty"""
+    elem = dset.get_item(keyword)
+    if elem is None:
+        return None
+
+    # Elements that pydicom has not converted yet are parsed straight from their raw bytes,
+    # which avoids building a DSfloat for every value.  Empty components (e.g. b'1.0\\')
+    # are skipped, and anything else the fast parse rejects is left to pydicom.
+    if isinstance(elem, RawDataElement):
+        if elem.value is not None:
+            values = [value for value in elem.value.split(b'\\') if value.strip()]
+            try:
+                return np.array(values, dtype=float) if values else None
+            except ValueError:
+                pass
+        elem = dset[keyword]
+
+    value = elem.value
+    if not isinstance(value, (list, tuple, MultiValue)):
+        value = [value]
+    values = [item for item in value if (item is not None) and (item != '')]
+    if not values:
+        return None
+    return np.array(values, dtype=float)
+
 class DicomImage:
-    def __init__(self, dset, frame_idx=0):
+    def __init__(self, dset, frame_idx=0, is_enhanced=None, frame_cache=None):
         self.dset = dset
         self.frame_idx = frame_idx
-        self.is_enhanced = (dset.SOPClassUID.name == 'Enhanced MR Image Storage')
-        
+        # Decoded multi-frame pixel data keyed by id(dset), shared by the frames of a series
+        self._frame_cache = {} if frame_cache is None else frame_cache
+        # Callers expanding a multi-frame file pass is_enhanced so the SOP class is checked once per file
+        self.is_enhanced = (dset.SOPClassUID == EnhancedMRImageStorage) if is_enhanced is None else is_enhanced
+        # Most properties look up functional groups, so resolve each group once per frame
+        self._group_cache = {}
+        self._ds_cache = {}
+        self._slice_location = None
+
     def get_group(self, group_name):
         if not self.is_enhanced:
             return None
-            
+
+        if group_name in self._group_cache:
+            return self._group_cache[group_name]
+
+        group = None
         # Check PerFrame
         if group_name in self.dset.PerFrameFunctionalGroupsSequence[self.frame_idx]:
-            return self.dset.PerFrameFunctionalGroupsSequence[self.frame_idx][group_name][0]
+            group = self.dset.PerFrameFunctionalGroupsSequence[self.frame_idx][group_name][0]
         # Check Shared
-        if group_name in self.dset.SharedFunctionalGroupsSequence[0]:
-            return self.dset.SharedFunctionalGroupsSequence[0][group_name][0]
-        return None
+        elif group_name in self.dset.SharedFunctionalGroupsSequence[0]:
+            group = self.dset.SharedFunctionalGroupsSequence[0][group_name][0]
+        self._group_cache[group_name] = group
+        return group
+
+    def get_ds(self, keyword, group_name=None, default=None):
+        """Get a DS element of the dataset (or of a functional group) as a cached float array"""
+        if keyword not in self._ds_cache:
+            if group_name is None:
+                value = _get_ds(self.dset, keyword)
+                if value is None:
+                    # Keep pydicom's behaviour for absent or empty elements
+                    value = getattr(self.dset, keyword)
+            else:
+                group = self.get_group(group_name)
+                value = _get_ds(group, keyword) if group else None
+                if value is None:
+                    value = default
+            self._ds_cache[keyword] = value
+        return self._ds_cache[keyword]
 
     @property
     def pixel_array(self):
+        # Headers are read without pixel data, so decode it from the file on first use
         if self.is_enhanced:
-            return self.dset.pixel_array[self.frame_idx]
+            # All frames share one file: decode it once and keep it until the series is written
+            frames = self._frame_cache.get(id(self.dset))
+            if frames is None:
+                frames = _read_pixel_array(self.dset.filename)
+                self._frame_cache[id(self.dset)] = frames
+            return frames[self.frame_idx]
         else:
-            return self.dset.pixel_array
+            return _read_pixel_array(self.dset.filename)
 
     @property
     def PixelSpacing(self):
         if self.is_enhanced:
-            measure = self.get_group('PixelMeasuresSequence')
-            if measure:
-                return measure.PixelSpacing
-            return [1.0, 1.0]
+            return self.get_ds('PixelSpacing', 'PixelMeasuresSequence', np.array([1.0, 1.0]))
         else:
-            return self.dset.PixelSpacing
+            return self.get_ds('PixelSpacing')
 
     @property
     def SliceThickness(self):
@@ -87,37 +158,36 @@ class DicomImage:
     @property
     def ImagePositionPatient(self):
         if self.is_enhanced:
-            pos = self.get_group('PlanePositionSequence')
-            if pos:
-                return pos.ImagePositionPatient
-            return [0.0, 0.0, 0.0]
+            return self.get_ds('ImagePositionPatient', 'PlanePositionSequence', np.zeros(3))
         else:
-            return self.dset.ImagePositionPatient
+            return self.get_ds('ImagePositionPatient')
 
     @property
     def ImageOrientationPatient(self):
         if self.is_enhanced:
-            orient = self.get_group('PlaneOrientationSequence')
-            if orient:
-                return orient.ImageOrientationPatient
-            print("WARNING: PlaneOrientationSequence missing from DICOM, using default orientation [1,0,0,0,1,0]")
-            return [1, 0, 0, 0, 1, 0]
+            if self.get_group('PlaneOrientationSequence') is None:
+                print("WARNING: PlaneOrientationSequence missing from DICOM, using default orientation [1,0,0,0,1,0]")
+            return self.get_ds('ImageOrientationPatient', 'PlaneOrientationSequence', np.array([1.0, 0.0, 0.0, 0.0, 1.0, 0.0]))
         else:
-            return self.dset.ImageOrientationPatient
+            return self.get_ds('ImageOrientationPatient')
 
     @property
     def SliceLocation(self):
+        if self._slice_location is None:
+            self._slice_location = self._compute_slice_location()
+        return self._slice_location
+
+    def _compute_slice_location(self):
         # Calculate SliceLocation from Position and Orientation to be consistent
         # SliceLocation is the projection of Position onto the normal vector of the slice.
-        try:
-            pos = np.array(self.ImagePositionPatient, dtype=float)
-            orient = np.array(self.ImageOrientationPatient, dtype=float)
-            normal = np.cross(orient[0:3], orient[3:6])
-            return np.dot(pos, normal)
-        except Exception:
-            if not self.is_enhanced and 'SliceLocation' in self.dset:
-                return self.dset.SliceLocation
-            return 0.0
+        if self.is_enhanced or ('ImagePositionPatient' in self.dset and 'ImageOrientationPatient' in self.dset):
+            pos = self.ImagePositionPatient
+            orient = self.ImageOrientationPatient
+            if len(pos) == 3 and len(orient) == 6:
+                return np.dot(pos, np.cross(orient[0:3], orient[3:6]))
+        if not self.is_enhanced and self.dset.get('SliceLocation') not in (None, ''):
+            return float(self.dset.SliceLocation)
+        return 0.0
 
     @property
     def TemporalPositionIndex(self):
@@ -147,14 +217,15 @@ class DicomImage:
     def TriggerTime(self):
         if self.is_enhanced:
             cardiac = self.get_group('CardiacSynchronizationSequence')
-            if cardiac and 'NominalCardiacTriggerDelayTime' in cardiac:
+            if cardiac and cardiac.get('NominalCardiacTriggerDelayTime') not in (None, ''):
                 return float(cardiac.NominalCardiacTriggerDelayTime)
             
             # Fallback to FrameContentSequence -> TemporalPositionIndex if needed?
             # Or just return 0.0
             return 0.0
         else:
-            return float(self.dset.get('TriggerTime', 0.0))
+            trigger_time = self.dset.get('TriggerTime')
+            return float(trigger_time) if trigger_time not in (None, '') else 0.0
 
     @property
     def AcquisitionTime(self):
@@ -229,21 +300,61 @@ class DicomImage:
         return self.dset.get('SequenceName', '')
         
     def get_private_item(self, group, element, creator):
-        try:
-            return self.dset.get_private_item(group, element, creator)
-        except Exception:
+        if creator not in self.dset.private_creators(group):
             return None
+        block = self.dset.private_block(group, creator)
+        return block[element] if element in block else None
+
+
+def _set_slice_locations(images):
+    """Compute SliceLocation for all images of a series with array operations"""
+    try:
+        positions = np.array([img.ImagePositionPatient for img in images], dtype=float)
+        orientations = np.array([img.ImageOrientationPatient for img in images], dtype=float)
+    except (AttributeError, TypeError, ValueError):
+        # Missing or malformed geometry: leave SliceLocation to its per-image fallback
+        return
+    if positions.shape != (len(images), 3) or orientations.shape != (len(images), 6):
+        return
+
+    normals = np.cross(orientations[:, 0:3], orientations[:, 3:6])
+    for img, slice_loc in zip(images, np.einsum('ij,ij->i', positions, normals)):
+        img._slice_location = slice_loc
 
-    def to_json(self):
-        return self.dset.to_json()
+
+def _read_pixel_array(path):
+    """Decode the pixel data of a DICOM file whose header was read without it"""
+    return pydicom.dcmread(path).pixel_array
 
 
 def _normalize(vec):
     vec = np.asarray(vec, dtype=float)
-    norm = np.linalg.norm(vec)
-    if norm == 0:
+    norm_sq = vec @ vec
+    # Axis-aligned orientations are already unit length
+    if norm_sq == 1.0 or norm_sq == 0.0:
         return vec
-    return vec / norm
+    return vec / np.sqrt(norm_sq)
+
+
+def _get_directions(orientation):
+    """Read, phase and slice directions from an ImageOrientationPatient value"""
+    row_dir = _normalize(orientation[0:3])   # DICOM "row direction cosines" = direction along image columns (x-axis)
+    col_dir = _normalize(orientation[3:6])   # DICOM "column direction cosines" = direction along image rows (y-axis)
+    slice_dir = _normalize(np.cross(row_dir, col_dir))
+    return row_dir, col_dir, slice_dir
+
+
+# Serialized meta XML keyed by its attributes; the slices of a series share only a few distinct sets
+meta_xml_cache = {}
+
+def _serialize_meta(meta):
+    """Serialize an ismrmrd.Meta, reusing the XML of an identical attribute set"""
+    key = tuple((name, tuple(value) if isinstance(value, list) else value) for name, value in meta.items())
+    xml = meta_xml_cache.get(key)
+    if xml is None:
+        xml = meta.serialize()
+        meta_xml_cache[key] = xml
+    return xml
 
 
 def _coerce_image_type_values(value):
@@ -306,7 +417,7 @@ def CreateMrdHeader(dset):
     encSpace.matrixSize.z                                       = 1
     encSpace.fieldOfView_mm                                     = ismrmrd.xsd.fieldOfViewMm()
     
-    if dset.SOPClassUID.name == 'Enhanced MR Image Storage':
+    if dset.SOPClassUID == EnhancedMRImageStorage:
         # Use first frame as reference
         groups = dset.SharedFunctionalGroupsSequence[0]
         if 'PixelMeasuresSequence' not in groups:
@@ -332,7 +443,7 @@ def CreateMrdHeader(dset):
     enc.parallelImaging                                         = ismrmrd.xsd.parallelImagingType()
 
     enc.parallelImaging.accelerationFactor                      = ismrmrd.xsd.accelerationFactorType()
-    if dset.SOPClassUID.name == 'Enhanced MR Image Storage':
+    if dset.SOPClassUID == EnhancedMRImageStorage:
         # Try to find MRModifierSequence
         found_accel = False
         if 'MRModifierSequence' in dset.SharedFunctionalGroupsSequence[0]:
@@ -355,44 +466,86 @@ def CreateMrdHeader(dset):
 
     return mrdHead
 
+def _write_images(mrdDset, impath, images):
+    """Write a list of MRD images to an image group, allocating its datasets once.
+
+    The layout matches ismrmrd.Dataset.append_image (header, attributes and data datasets,
+    resizable along the image axis), but without resizing every dataset once per image.
+    Falls back to append_image if the group already exists or the images differ in shape/type.
+    """
+    group = mrdDset._dataset.require_group(impath)
+    data_type = images[0].data_type
+    data_shape = images[0].data.shape
+    if ('header' in group) or any((img.data_type != data_type) or (img.data.shape != data_shape) for img in images):
+        for img in images:
+            mrdDset.append_image(impath, img)
+        return
+
+    hdf5_type = ismrmrd.hdf5.get_hdf5type(data_type)
+    headers = np.concatenate([np.frombuffer(img.getHead(), dtype=ismrmrd.hdf5.image_header_dtype) for img in images])
+    group.create_dataset('header', data=headers, maxshape=(None,))
+    group.create_dataset('attributes', data=[img.attribute_string for img in images], maxshape=(None,), dtype=h5py.special_dtype(vlen=str))
+    data = group.create_dataset('data', (len(images),) + data_shape, maxshape=(None,) + data_shape, chunks=(1,) + data_shape, dtype=hdf5_type)
+    for i, img in enumerate(images):
+        data[i] = img.data.view(dtype=hdf5_type)
+
+
 def GetDicomFiles(directory):
     """Get path to all DICOMs in a directory and its sub-directories"""
-    for entry in os.scandir(directory):
-        if entry.is_file() and (entry.path.lower().endswith(".dcm") or entry.path.lower().endswith(".ima")):
-            yield entry.path
-        elif entry.is_dir():
-            yield from GetDicomFiles(entry.path)
+    for root, _, files in os.walk(directory, followlinks=True):
+        for f in files:
+            if f.lower().endswith((".dcm", ".ima")):
+                yield os.path.join(root, f)
+
+
+def _safe_dcmread(path):
+    """Read a DICOM header without pixel data, or return None if it can't be parsed"""
+    try:
+        # Large values are deferred and only read from disk when accessed
+        return pydicom.dcmread(path, stop_before_pixels=True, defer_size='4 KB')
+    except Exception as e:
+        print(f"Error reading {path}: {e}")
+        return None
 
 
 def main(args):
-    dsetsAll = []
-    for entryPath in GetDicomFiles(args.folder):
-        try:
-            dset = pydicom.dcmread(entryPath)
-            dsetsAll.append(dset)
-        except Exception as e:
-            print(f"Error reading {entryPath}: {e}")
+    # Parsing is independent per file, so spread it over all cores
+    paths = list(GetDicomFiles(args.folder))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        dsetsAll = [dset for dset in executor.map(_safe_dcmread, paths, chunksize=16) if dset is not None]
 
     if not dsetsAll:
         print(f"No DICOM files found in {args.folder}")
         return
 
     # Group by series number
-    uSeriesNum = np.unique([dset.SeriesNumber for dset in dsetsAll])
+    series_nums = np.fromiter((dset.SeriesNumber for dset in dsetsAll), dtype=np.int64, count=len(dsetsAll))
+    uSeriesNum = np.unique(series_nums)
 
     # Re-group series that were split during conversion from multi-frame to single-frame DICOMs
-    if all(uSeriesNum > 1000):
-        for i in range(len(dsetsAll)):
-            dsetsAll[i].SeriesNumber = int(np.floor(dsetsAll[i].SeriesNumber / 1000))
-    uSeriesNum = np.unique([dset.SeriesNumber for dset in dsetsAll])
+    if uSeriesNum.min() > 1000:
+        series_nums //= 1000
+        for dset, series_num in zip(dsetsAll, series_nums.tolist()):
+            dset.SeriesNumber = series_num
+        uSeriesNum = np.unique(series_nums)
 
     print("Found %d unique series from %d files in folder %s" % (len(uSeriesNum), len(dsetsAll), args.folder))
 
     print("Creating MRD XML header from file %s" % dsetsAll[0].filename)
     mrdHead = CreateMrdHeader(dsetsAll[0])
-    print(mrdHead.toXML())
+    header_xml = mrdHead.toXML()
+    print(header_xml)
 
-    imgAll = [None]*len(uSeriesNum)
+    # Create an MRD file
+    print("Creating MRD file %s with group %s" % (args.outFile, args.outGroup))
+    mrdDset = ismrmrd.Dataset(args.outFile, args.outGroup)
+    mrdDset._file.require_group(args.outGroup)
+
+    # Write MRD Header
+    mrdDset.write_xml_header(header_xml.encode('utf-8'))
+
+    # Each series is written as soon as it is converted, so only one series is held in memory
+    first_img = None
 
     for iSer in range(len(uSeriesNum)):
         # Get all files for this series
@@ -400,13 +553,16 @@ def main(args):
         
         # Expand to DicomImage objects (handling Enhanced DICOM frames)
         images = []
+        frame_cache = {}
         for dset in series_dsets:
-            if dset.SOPClassUID.name == 'Enhanced MR Image Storage':
+            if dset.SOPClassUID == EnhancedMRImageStorage:
                 nFrames = getattr(dset, 'NumberOfFrames', 1)
                 for i in range(nFrames):
-                    images.append(DicomImage(dset, i))
+                    images.append(DicomImage(dset, i, is_enhanced=True, frame_cache=frame_cache))
             else:
-                images.append(DicomImage(dset))
+                images.append(DicomImage(dset, is_enhanced=False))
+
+        _set_slice_locations(images)
 
         # Group by Phase (TemporalPositionIndex for Enhanced, TriggerTime for others)
         is_enhanced_series = any(img.is_enhanced for img in images)
@@ -416,13 +572,16 @@ def main(args):
         else:
              key_func = lambda img: img.TriggerTime
 
-        uKeys = sorted(list(set(key_func(img) for img in images)))
-        
-        imgAll[iSer] = []
-        
-        for iPhase, key in enumerate(uKeys):
+        # Bucket images by phase in a single pass, keeping their original order within a phase
+        phase_groups = collections.defaultdict(list)
+        for img in images:
+            phase_groups[key_func(img)].append(img)
+
+        series_imgs = []
+
+        for iPhase, key in enumerate(sorted(phase_groups)):
             # Get images for this phase
-            phase_imgs = [img for img in images if key_func(img) == key]
+            phase_imgs = phase_groups[key]
             
             # Sort slices robustly:
             # 1) Enhanced frame stack coordinates when available
@@ -431,35 +590,29 @@ def main(args):
             def sort_key(img):
                 in_stack = img.InStackPositionNumber
                 stack_id = img.StackID or ''
-                try:
-                    slice_loc = float(img.SliceLocation)
-                except Exception:
-                    slice_loc = 0.0
                 return (
                     0 if in_stack is not None else 1,
                     stack_id,
                     int(in_stack) if in_stack is not None else 0,
-                    slice_loc,
+                    float(img.SliceLocation),
                     int(img.InstanceNumber),
                 )
 
             phase_imgs.sort(key=sort_key)
 
+            # Orientation is normally shared by every slice of a phase, so derive the directions once
+            phase_orientation = list(phase_imgs[0].ImageOrientationPatient)
+            phase_dirs = _get_directions(phase_orientation)
+            same_orientation = all(list(img.ImageOrientationPatient) == phase_orientation for img in phase_imgs[1:])
+
             # Ensure slice index increases in the same physical direction as slice_dir.
             if len(phase_imgs) > 1:
-                row_dir = _normalize(phase_imgs[0].ImageOrientationPatient[0:3])
-                col_dir = _normalize(phase_imgs[0].ImageOrientationPatient[3:6])
-                slice_dir = _normalize(np.cross(row_dir, col_dir))
-
-                for i_check in range(1, len(phase_imgs)):
-                    pos0 = np.asarray(phase_imgs[0].ImagePositionPatient, dtype=float)
-                    pos1 = np.asarray(phase_imgs[i_check].ImagePositionPatient, dtype=float)
-                    step = float(np.dot(pos1 - pos0, slice_dir))
-                    if step < 0:
-                        phase_imgs.reverse()
-                        break
-                    if step > 0:
-                        break
+                positions = np.array([img.ImagePositionPatient for img in phase_imgs], dtype=float)
+                # The first slice that moves away from the first position decides the direction
+                steps = (positions[1:] - positions[0]) @ phase_dirs[2]
+                nonzero = np.flatnonzero(steps)
+                if nonzero.size and steps[nonzero[0]] < 0:
+                    phase_imgs.reverse()
             
             if not phase_imgs:
                 continue
@@ -475,12 +628,8 @@ def main(args):
 
                 itype_values = _coerce_image_type_values(sliceImg.ImageType)
 
-                try:
-                    complex_component = sliceImg.ComplexImageComponent
-                    tmpMrdImg.image_type = complex_component_map.get(complex_component, ismrmrd.IMTYPE_MAGNITUDE)
-                except Exception:
-                    print("Unsupported ComplexImageComponent/ImageType %s -- defaulting to IMTYPE_MAGNITUDE" % sliceImg.ImageType)
-                    tmpMrdImg.image_type = ismrmrd.IMTYPE_MAGNITUDE
+                complex_component = sliceImg.ComplexImageComponent
+                tmpMrdImg.image_type = complex_component_map.get(complex_component, ismrmrd.IMTYPE_MAGNITUDE)
 
                 # DICOM PixelSpacing is [row_spacing, col_spacing] => [Y, X].
                 tmpMrdImg.field_of_view = (
@@ -492,9 +641,10 @@ def main(args):
                 # Note: matrix_size is read-only and derived from data shape (cols, rows, 1 for 2D slices)
                 # The slice index indicates position within the volume
                 
-                row_dir = _normalize(sliceImg.ImageOrientationPatient[0:3])   # DICOM "row direction cosines" = direction along image columns (x-axis)
-                col_dir = _normalize(sliceImg.ImageOrientationPatient[3:6])  # DICOM "column direction cosines" = direction along image rows (y-axis)
-                slice_dir = _normalize(np.cross(row_dir, col_dir))
+                if same_orientation:
+                    row_dir, col_dir, slice_dir = phase_dirs
+                else:
+                    row_dir, col_dir, slice_dir = _get_directions(sliceImg.ImageOrientationPatient)
 
                 tmpMrdImg.position = tuple(np.asarray(sliceImg.ImagePositionPatient, dtype=float))
                 tmpMrdImg.read_dir = tuple(row_dir)
@@ -502,34 +652,25 @@ def main(args):
                 tmpMrdImg.slice_dir = tuple(slice_dir)
                 
                 # AcquisitionTime HHMMSS.FFFFFF
-                acq_time = sliceImg.AcquisitionTime
-                try:
-                    # Handle potential empty or malformed time
-                    if acq_time and len(acq_time) >= 6:
-                        h = int(acq_time[0:2])
-                        m = int(acq_time[2:4])
-                        s = int(acq_time[4:6])
-                        f = float(acq_time[6:]) if len(acq_time) > 6 else 0.0
-                        tmpMrdImg.acquisition_time_stamp = round((h*3600 + m*60 + s + f)*1000/2.5)
-                    else:
-                        tmpMrdImg.acquisition_time_stamp = 0
-                except Exception:
+                # Empty or malformed times don't match and get a zero timestamp
+                acq_time = acq_time_re.match(str(sliceImg.AcquisitionTime or ''))
+                if acq_time:
+                    h = int(acq_time[1])
+                    m = int(acq_time[2])
+                    s = int(acq_time[3])
+                    f = float(acq_time[4]) if acq_time[4] else 0.0
+                    tmpMrdImg.acquisition_time_stamp = round((h*3600 + m*60 + s + f)*1000/2.5)
+                else:
                     tmpMrdImg.acquisition_time_stamp = 0
 
-                try:
-                    tmpMrdImg.physiology_time_stamp[0] = int(round(sliceImg.TriggerTime / 2.5))
-                except Exception:
-                    pass
+                tmpMrdImg.physiology_time_stamp[0] = int(round(sliceImg.TriggerTime / 2.5))
 
-                try:
-                    item = sliceImg.get_private_item(0x0019, 0x13, 'SIEMENS MR HEADER')
-                    if item:
-                        ImaAbsTablePosition = item.value
-                        tmpMrdImg.patient_table_position = (ctypes.c_float(ImaAbsTablePosition[0]), ctypes.c_float(ImaAbsTablePosition[1]), ctypes.c_float(ImaAbsTablePosition[2]))
-                except Exception:
-                    pass
+                item = sliceImg.get_private_item(0x0019, 0x13, 'SIEMENS MR HEADER')
+                if (item is not None) and (item.VM == 3):
+                    ImaAbsTablePosition = item.value
+                    tmpMrdImg.patient_table_position = (ctypes.c_float(ImaAbsTablePosition[0]), ctypes.c_float(ImaAbsTablePosition[1]), ctypes.c_float(ImaAbsTablePosition[2]))
 
-                tmpMrdImg.image_series_index     = uSeriesNum.tolist().index(sliceImg.SeriesNumber)
+                tmpMrdImg.image_series_index     = iSer
                 tmpMrdImg.image_index            = sliceImg.InstanceNumber
                 
                 tmpMrdImg.slice = iSlice
@@ -546,58 +687,43 @@ def main(args):
                         image_type_tail = itype_values[3:]
                         tmpMeta['ImageType'] = image_type_tail[0] if len(image_type_tail) == 1 else image_type_tail
                         tmpMeta['ImageTypeValue4'] = itype_values[3]
-                tmpMeta['ComplexImageComponent'] = sliceImg.ComplexImageComponent
-
-                try:
-                    seq_name = sliceImg.SequenceName
-                    res  = re.search(r'(?<=_v).*$',     seq_name)
-                    if res:
-                        venc = re.search(r'^\d+',           res.group(0))
-                        dir  = re.search(r'(?<=\d)[^\d]*$', res.group(0))
-                        if venc and dir:
-                            tmpMeta['FlowVelocity']   = float(venc.group(0))
-                            tmpMeta['FlowDirDisplay'] = venc_dir_map.get(dir.group(0), '')
-                except Exception:
-                    pass
-
-                try:
-                    tmpMeta['ImageComments'] = sliceImg.ImageComments
-                except Exception:
-                    pass
+                tmpMeta['ComplexImageComponent'] = complex_component
+
+                venc = venc_re.search(str(sliceImg.SequenceName))
+                if venc:
+                    tmpMeta['FlowVelocity']   = float(venc.group(1))
+                    tmpMeta['FlowDirDisplay'] = venc_dir_map.get(venc.group(2), '')
+
+                tmpMeta['ImageComments'] = sliceImg.ImageComments
 
                 tmpMeta['SeriesDescription'] = sliceImg.SeriesDescription
                 tmpMeta['SequenceDescription'] = sliceImg.SeriesDescription
                 tmpMeta['Keep_image_geometry'] = 1
 
-                tmpMrdImg.attribute_string = tmpMeta.serialize()
+                tmpMrdImg.attribute_string = _serialize_meta(tmpMeta)
                 
-                imgAll[iSer].append(tmpMrdImg)
+                series_imgs.append(tmpMrdImg)
         
-        print("Series %d: Created %d 2D images (slices x phases)" % (uSeriesNum[iSer], len(imgAll[iSer])))
+        print("Series %d: Created %d 2D images (slices x phases)" % (uSeriesNum[iSer], len(series_imgs)))
 
-    # Create an MRD file
-    print("Creating MRD file %s with group %s" % (args.outFile, args.outGroup))
-    mrdDset = ismrmrd.Dataset(args.outFile, args.outGroup)
-    mrdDset._file.require_group(args.outGroup)
+        # One image group per series
+        if series_imgs:
+            _write_images(mrdDset, "image_%d" % iSer, series_imgs)
+            if iSer == 0:
+                first_img = series_imgs[0]
+        series_imgs = None
 
-    # Write MRD Header
-    mrdDset.write_xml_header(bytes(mrdHead.toXML(), 'utf-8'))
+        # Release the decoded multi-frame pixel data of this series
+        frame_cache.clear()
 
-    # Write all images
-    for iSer in range(len(imgAll)):
-        for iImg in range(len(imgAll[iSer])):
-            if imgAll[iSer][iImg] is not None:
-                mrdDset.append_image("image_%d" % imgAll[iSer][iImg].image_series_index, imgAll[iSer][iImg])
-
-    if len(imgAll) > 0 and len(imgAll[0]) > 0 and imgAll[0][0] is not None:
-        first_img = imgAll[0][0]
+    if first_img is not None:
         print(f"First Image FOV: {first_img.field_of_view}")
         print(f"First Image Matrix Size: {first_img.matrix_size}")
 
-    print(f"Header FOV: {mrdHead.encoding[0].encodedSpace.fieldOfView_mm.x} {mrdHead.encoding[0].encodedSpace.fieldOfView_mm.y} {mrdHead.encoding[0].encodedSpace.fieldOfView_mm.z}")
-    
     fov = mrdHead.encoding[0].encodedSpace.fieldOfView_mm
     matrix = mrdHead.encoding[0].encodedSpace.matrixSize
+    print(f"Header FOV: {fov.x} {fov.y} {fov.z}")
+    
     print(f"Computed Voxel Size: {fov.x/matrix.x} {fov.y/matrix.y} {fov.z/matrix.z}")
 
     mrdDset.close()
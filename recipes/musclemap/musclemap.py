@@ -1,6 +1,7 @@
 import ismrmrd
 import csv
 import copy
+import functools
 import glob
 import os
 import itertools
@@ -176,6 +177,15 @@ metricsOutputModeFlags = {
     "metadata": (True, False, True, True),
     "none": (False, False, False, False),
 }
+# Acquisition flag bits (MRD flags are 1-based bit positions), tested with a
+# single mask instead of one is_flag_set() call per flag
+acqSkipFlagsMask = (
+    (1 << (ismrmrd.ACQ_IS_NOISE_MEASUREMENT - 1))
+    | (1 << (ismrmrd.ACQ_IS_PARALLEL_CALIBRATION - 1))
+    | (1 << (ismrmrd.ACQ_IS_PHASECORR_DATA - 1))
+    | (1 << (ismrmrd.ACQ_IS_NAVIGATION_DATA - 1))
+)
+acqLastInSliceMask = 1 << (ismrmrd.ACQ_LAST_IN_SLICE - 1)
 
 
 def process(connection, config, metadata):
@@ -246,17 +256,13 @@ def process(connection, config, metadata):
             # ----------------------------------------------------------
             if isinstance(item, ismrmrd.Acquisition):
                 # Accumulate all imaging readouts in a group
-                if (
-                    not item.is_flag_set(ismrmrd.ACQ_IS_NOISE_MEASUREMENT)
-                    and not item.is_flag_set(ismrmrd.ACQ_IS_PARALLEL_CALIBRATION)
-                    and not item.is_flag_set(ismrmrd.ACQ_IS_PHASECORR_DATA)
-                    and not item.is_flag_set(ismrmrd.ACQ_IS_NAVIGATION_DATA)
-                ):
+                acqFlags = item.flags
+                if not (acqFlags & acqSkipFlagsMask):
                     acqGroup.append(item)
 
                 # When this criteria is met, run process_raw() on the accumulated
                 # data, which returns images that are sent back to the client.
-                if item.is_flag_set(ismrmrd.ACQ_LAST_IN_SLICE):
+                if acqFlags & acqLastInSliceMask:
                     logging.info("Processing a group of k-space data")
                     # image = process_raw(acqGroup, connection, config, metadata)
                     acqGroup = []
@@ -270,7 +276,7 @@ def process(connection, config, metadata):
                 # Only process the selected magnitude Dixon image type(s).
                 # Phase/complex images and unselected Dixon contrasts are returned
                 # as source-native original/passthrough images.
-                tmpMeta = ismrmrd.Meta.deserialize(item.attribute_string)
+                tmpMeta = _deserialize_meta(item.attribute_string)
                 inputDecision = _resolve_segmentation_input_decision(
                     item,
                     tmpMeta,
@@ -322,8 +328,10 @@ def process(connection, config, metadata):
                 if shouldProcess:
                     processableImageGroups.setdefault(itemProcessGroupKey, []).append(item)
                 else:
-                    tmpMeta["Keep_image_geometry"] = 1
-                    item.attribute_string = tmpMeta.serialize()
+                    # Only re-serialize the attributes when the flag is not already set
+                    if tmpMeta.get("Keep_image_geometry") != "1":
+                        tmpMeta["Keep_image_geometry"] = 1
+                        item.attribute_string = tmpMeta.serialize()
                     passthroughImages.append(item)
                     continue
 
@@ -472,25 +480,18 @@ def compute_nifti_affine(image_header, voxel_size, slice_axis=None):
     # Convert by negating x and y components.
     lps_to_ras = np.array([-1, -1, 1], dtype=float)
 
-    position  = np.array(image_header.position)  * lps_to_ras
-    read_dir  = np.array(image_header.read_dir)   * lps_to_ras
-    phase_dir = np.array(image_header.phase_dir)  * lps_to_ras
-    raw_slice_dir = np.array(image_header.slice_dir, dtype=float)
-    if np.linalg.norm(raw_slice_dir) < 1e-8 and slice_axis is not None:
-        raw_slice_dir = np.asarray(slice_axis, dtype=float)
-    slice_dir = raw_slice_dir * lps_to_ras
-
-    # Construct rotation-scaling matrix
-    rotation_scaling_matrix = np.column_stack([
-        voxel_size[0] * read_dir,
-        voxel_size[1] * phase_dir,
-        voxel_size[2] * slice_dir,
-    ])
-
-    # Construct affine matrix
+    # Fill the affine in place: direction columns, then the position
     affine = np.eye(4)
-    affine[:3, :3] = rotation_scaling_matrix
-    affine[:3,  3] = position
+    affine[:3, 0] = image_header.read_dir
+    affine[:3, 1] = image_header.phase_dir
+    affine[:3, 2] = image_header.slice_dir
+    if np.linalg.norm(affine[:3, 2]) < 1e-8 and slice_axis is not None:
+        affine[:3, 2] = slice_axis
+    affine[:3, 3] = image_header.position
+
+    # Scale the direction columns by the voxel size and convert every row to RAS
+    affine[:3, :3] *= np.asarray(voxel_size, dtype=float)[:3]
+    affine[:3] *= lps_to_ras[:, None]
 
     return affine
 
@@ -824,7 +825,7 @@ def _match_ff_carriers_to_segmentation(seg_projected_positions, carriers, slice_
 
 def _is_native_ff_compose_image(image):
     try:
-        meta_obj = ismrmrd.Meta.deserialize(image.attribute_string)
+        meta_obj = _deserialize_meta(image.attribute_string)
     except Exception:
         return False
     return _get_first_meta_int(meta_obj, [composeNativeFfMarkerMetaKey]) == 1
@@ -846,7 +847,7 @@ def _is_compose_fat_fraction_image(image, meta_obj=None):
     """
     if meta_obj is None:
         try:
-            meta_obj = ismrmrd.Meta.deserialize(image.attribute_string)
+            meta_obj = _deserialize_meta(image.attribute_string)
         except Exception:
             return False
     minihead_text = _decode_ice_minihead(meta_obj)
@@ -1171,7 +1172,7 @@ def _build_passthrough_output_identity(source_meta, role, output_series_index):
 
 def _passthrough_source_group_key(image):
     try:
-        source_meta = ismrmrd.Meta.deserialize(image.attribute_string)
+        source_meta = _deserialize_meta(image.attribute_string)
     except Exception:
         source_meta = ismrmrd.Meta()
     source_minihead = _decode_ice_minihead(source_meta)
@@ -1233,7 +1234,7 @@ def _original_storage_fields(source_image, output_index):
         header_image_index = output_index + 1
 
     try:
-        source_meta = ismrmrd.Meta.deserialize(source_image.attribute_string)
+        source_meta = _deserialize_meta(source_image.attribute_string)
     except Exception:
         source_meta = ismrmrd.Meta()
     minihead_text = _decode_ice_minihead(source_meta)
@@ -1576,7 +1577,7 @@ def _original_passthrough_meta(
     output_index,
     storage_fields,
 ):
-    source_meta = _copy_meta(ismrmrd.Meta.deserialize(source_image.attribute_string))
+    source_meta = _deserialize_meta(source_image.attribute_string)
     _strip_source_parent_refs(source_meta)
     series_description = output_identity["series_description"]
     series_grouping = output_identity["grouping"]
@@ -1842,7 +1843,7 @@ def _restamp_passthrough_images(images, role, output_series_index):
     if not image_list:
         return []
 
-    base_meta = _copy_meta(ismrmrd.Meta.deserialize(image_list[0].attribute_string))
+    base_meta = _deserialize_meta(image_list[0].attribute_string)
     output_identity = _build_passthrough_output_identity(base_meta, role, output_series_index)
     restamped_images = []
     for output_index, image in enumerate(image_list):
@@ -2200,6 +2201,24 @@ def _explicit_header_geometry_meta(header):
     return _header_geometry_meta(header)
 
 
+@functools.lru_cache(maxsize=32)
+def _parse_meta_cached(attribute_string):
+    return ismrmrd.Meta.deserialize(attribute_string)
+
+
+def _deserialize_meta(attribute_string):
+    # The same image's attributes are parsed by several helpers (input decision,
+    # grouping, storage fields, contract checks, logging), so reuse the parse of an
+    # identical string. Those parses happen back to back, so only a few recent
+    # strings are kept. Callers mutate the result, so each call gets its own copy.
+    if not isinstance(attribute_string, str):
+        return ismrmrd.Meta.deserialize(attribute_string)
+    cached = _parse_meta_cached(attribute_string)
+    return ismrmrd.Meta(
+        {key: list(value) if isinstance(value, list) else value for key, value in cached.items()}
+    )
+
+
 def _copy_meta(meta_obj):
     try:
         return ismrmrd.Meta.deserialize(meta_obj.serialize())
@@ -2556,7 +2575,7 @@ def _minihead_slice_identity(minihead_text):
 def _image_identity(image, meta_obj=None):
     header = image.getHead()
     if meta_obj is None:
-        meta_obj = ismrmrd.Meta.deserialize(image.attribute_string)
+        meta_obj = _deserialize_meta(image.attribute_string)
     minihead_text = _decode_ice_minihead(meta_obj)
     return {
         "header": {
@@ -2881,7 +2900,7 @@ def _series_contract_role(meta_obj, minihead_text):
 
 def _series_contract_entry(image, source="output"):
     try:
-        meta_obj = ismrmrd.Meta.deserialize(image.attribute_string)
+        meta_obj = _deserialize_meta(image.attribute_string)
     except Exception:
         meta_obj = ismrmrd.Meta()
     minihead_text = _decode_ice_minihead(meta_obj)
@@ -2963,7 +2982,7 @@ def _validate_output_storage_contract(output_images):
     seen_sop_uids = {}
     for image_index, image in enumerate(_as_image_list(output_images)):
         try:
-            meta_obj = ismrmrd.Meta.deserialize(image.attribute_string)
+            meta_obj = _deserialize_meta(image.attribute_string)
         except Exception:
             meta_obj = ismrmrd.Meta()
         minihead_text = _decode_ice_minihead(meta_obj)
@@ -3165,7 +3184,7 @@ def _log_send_batch_summary(images, context):
     }
     for image in images:
         header = image.getHead()
-        meta_obj = ismrmrd.Meta.deserialize(image.attribute_string)
+        meta_obj = _deserialize_meta(image.attribute_string)
         minihead_text = _decode_ice_minihead(meta_obj)
         _increment_group(groups["image_series_index"], int(getattr(header, "image_series_index", 0)))
         _increment_group(
@@ -3547,8 +3566,24 @@ def _format_metrics_minihead_value(metrics_result, max_chars=3500):
 
 
 def _transform_musclemap_label_values(labels):
-    labels = np.asarray(labels, dtype=np.int64)
-    return 3 * (labels // 10) + (labels % 10)
+    labels = np.asarray(labels)
+    if labels.size == 0 or not np.issubdtype(labels.dtype, np.integer) or labels.min() < 0:
+        labels = np.asarray(labels, dtype=np.int64)
+        return 3 * (labels // 10) + (labels % 10)
+
+    max_label = int(labels.max())
+    if max_label < 10:
+        # Single-digit labels map onto themselves
+        return labels.copy()
+
+    # Labels are bounded non-negative codes, so one table lookup per voxel replaces
+    # the divisions. Transformed values never exceed the input, so the table keeps
+    # the label dtype, and the output keeps the input's memory layout.
+    codes = np.arange(max_label + 1, dtype=labels.dtype)
+    lut = 3 * (codes // 10) + (codes % 10)
+    transformed = np.empty_like(labels)
+    np.take(lut, labels, out=transformed, mode='clip')
+    return transformed
 
 
 def _restore_musclemap_label_values(labels):
@@ -4091,7 +4126,7 @@ def _build_native_ff_compose_images(
         # Reuse the routing-critical Fat-Fraction identity; only mark the image,
         # refresh the comment, and patch display names so the resulting composed
         # series is scanner-visible as MuscleMap rather than the source 2ptFF.
-        meta_obj = _copy_meta(ismrmrd.Meta.deserialize(carrier.attribute_string))
+        meta_obj = _deserialize_meta(carrier.attribute_string)
         _patch_native_ff_compose_display_identity(meta_obj, display_identity)
         _set_meta_scalar(meta_obj, composeNativeFfMarkerMetaKey, 1)
         meta_obj["Keep_image_geometry"] = 1
@@ -4202,7 +4237,7 @@ def process_image(
 
     # Determine the source image type (e.g. "Water", "Fat", "In_Phase", …)
     # from the first image's metadata so the segmentation output is named accordingly.
-    _first_meta = ismrmrd.Meta.deserialize(imgGroup[0].attribute_string)
+    _first_meta = _deserialize_meta(imgGroup[0].attribute_string)
     source_volume_key = _build_image_volume_key(imgGroup[0])
     source_minihead = _decode_ice_minihead(_first_meta)
     _source_type_value = _resolve_source_dixon_image_type_token(_first_meta, source_minihead)
@@ -4241,7 +4276,7 @@ def process_image(
     # Note: The MRD Image class stores data as [cha z y x]
 
     unsorted_head = [img.getHead() for img in imgGroup]
-    unsorted_meta = [ismrmrd.Meta.deserialize(img.attribute_string) for img in imgGroup]
+    unsorted_meta = [_deserialize_meta(img.attribute_string) for img in imgGroup]
     slice_sort_indices, slice_axis, _ = _slice_sort_indices(unsorted_head)
     _log_slice_order_checkpoint(
         "incoming",
@@ -4258,8 +4293,12 @@ def process_image(
 
     ordered_img_group = [imgGroup[index] for index in slice_sort_indices]
 
-    # Extract image data into a 5D array of size [img cha z y x]
-    data = np.stack([img.data for img in ordered_img_group])
+    # Extract image data into a 5D array of size [img cha z y x], filling one
+    # preallocated buffer instead of stacking a temporary list of arrays
+    first_data = ordered_img_group[0].data
+    data = np.empty((len(ordered_img_group),) + first_data.shape, dtype=first_data.dtype)
+    for index, img in enumerate(ordered_img_group):
+        np.copyto(data[index], img.data, casting='no')
     head = [unsorted_head[index] for index in slice_sort_indices]
     meta = [unsorted_meta[index] for index in slice_sort_indices]
 
@@ -4303,45 +4342,38 @@ def process_image(
     voxelsize = fov/matrix
     _log_affine_slice_consistency(head, voxelsize)
 
-    print("matrix:")
-    print(matrix)
-    print("fov:")
-    print(fov)
-    print("voxelsize:") 
-    print(voxelsize)
+    logging.debug("matrix: %s", matrix)
+    logging.debug("fov: %s", fov)
+    logging.debug("voxelsize: %s", voxelsize)
 
     crop_size = data.shape
 
-    print("shape before transpose:")
-    print(data.shape)
+    logging.debug("shape before transpose: %s", data.shape)
 
-    # Reformat data to [y x img cha z], i.e. [row col slice ...]
-    data = data.transpose((3, 4, 0, 1, 2))
+    # Reformat data to NIfTI [x y img cha z], i.e. [col row slice ...], in a single transpose
+    data = data.transpose((4, 3, 0, 1, 2))
 
-    print("shape after initial transpose:")
-    print(data.shape)
+    logging.debug("shape after initial transpose: %s", data.shape)
 
     # convert data to nifti using nibabel
     affine = compute_nifti_affine(head[0], voxelsize, slice_axis=slice_axis)
-    print("affine matrix:")
-    print(affine)
+    logging.debug("affine matrix: %s", affine)
 
-    data = np.squeeze(data)
-    print("shape before saving nifti and running mm_segment:")
-    print(data.shape)
-
-    # Transpose from [y, x, z] to NIfTI [x, y, z].
-    if data.ndim == 2:
-        data_nifti = np.asarray(data.T[:, :, None])
-    else:
-        data_nifti = np.asarray(data.transpose((1, 0, 2)))
+    # Drop the singleton [cha z] axes explicitly; unlike squeeze this keeps a
+    # single-slice or single-row volume 3D and rejects multi-channel input
+    if data.shape[3] != 1 or data.shape[4] != 1:
+        raise ValueError(f"Expected single-channel 2D input images, got [x y img cha z] shape {data.shape}")
+    data_nifti = data.reshape(data.shape[:3])
+    logging.debug("shape before saving nifti and running mm_segment: %s", data_nifti.shape)
 
     # Store segmentation input as int16 for mm_segment compatibility.
-    i16 = np.iinfo(np.int16)
-    data_min = np.min(data_nifti)
-    data_max = np.max(data_nifti)
-    if data_min < i16.min or data_max > i16.max:
-        raise ValueError(f"Input image values [{data_min}, {data_max}] exceed int16 range")
+    # Only dtypes wider than int16 need a range scan
+    if not np.can_cast(data_nifti.dtype, np.int16):
+        i16 = np.iinfo(np.int16)
+        data_min = np.min(data_nifti)
+        data_max = np.max(data_nifti)
+        if data_min < i16.min or data_max > i16.max:
+            raise ValueError(f"Input image values [{data_min}, {data_max}] exceed int16 range")
     data_nifti = data_nifti.astype(np.int16, copy=False)
     new_img = nib.nifti1.Nifti1Image(data_nifti, affine)
 
@@ -4443,65 +4475,57 @@ def process_image(
     # Keep on-disk label values to avoid float conversion/rescaling artifacts.
     data = np.asarray(img.dataobj)
 
+    # The sorted unique labels also give the range without rescanning the volume
     unique_preview = np.unique(data)
     logging.info(
         "Loaded segmented labels: dtype=%s, range=[%s, %s], unique_count=%d",
         data.dtype,
-        np.min(data),
-        np.max(data),
+        unique_preview[0],
+        unique_preview[-1],
         unique_preview.size,
     )
     logging.info("Segmented labels preview (first 50): %s", unique_preview[:50])
 
+    # Integer label maps keep their on-disk dtype (typically uint8/int16) rather
+    # than being widened to int64; only float-coded labels need converting.
     if np.issubdtype(data.dtype, np.floating):
         rounded = np.rint(data)
         if not np.allclose(data, rounded, atol=1e-3):
             raise ValueError("Segmented labels are not integer-valued; refusing to cast.")
-        data = rounded
-
-    data = data.astype(np.int64, copy=False)
+        data = rounded.astype(np.int64)
 
     # Expected label coding ends in 0/1/2 (except background 0).
     bad_labels = np.unique(data[(data != 0) & ((data % 10) > 2)])
     if bad_labels.size > 0:
         raise ValueError(f"Unexpected labels detected (first 20): {bad_labels[:20].tolist()}")
 
-    print("maximum value in segmented data:")
-    print(np.max(data))
+    logging.debug("maximum value in segmented data: %s", unique_preview[-1])
 
     # Reformat data
-    print("shape after loading with nibabel")
-    print(data.shape)
+    logging.debug("shape after loading with nibabel: %s", data.shape)
 
     if data.ndim == 2:
         data = data[:, :, None]
 
-    # Bring [x, y, z] back to [y, x, z].
-    if data.ndim >= 3:
-        data = data.transpose((1, 0, 2))
-
-    data = data[..., None, None]
-    data = data.transpose((0, 1, 4, 3, 2))
+    # Bring [x, y, z] back to [y, x, z]. Each output slice data[:, :, i] is then a
+    # [y x] plane that from_array() takes directly.
+    data = data.transpose((1, 0, 2))
 
-    print("shape after applying transpose")
-    print(data.shape)
+    logging.debug("shape after applying transpose: %s", data.shape)
 
     # compare size of data to crop_size, if not identical do a center crop
-    print("crop_size:")
-    print(crop_size)
+    logging.debug("crop_size: %s", crop_size)
 
-    print("data shape before crop:")
-    print(data.shape)
+    logging.debug("data shape before crop: %s", data.shape)
     
     # crop_size is [img, cha, z, y, x]
-    # data is [y, x, 1, 1, img]
+    # data is [y, x, img]
     if data.shape[0] != crop_size[3] or data.shape[1] != crop_size[4]:
-        crop_y = int((data.shape[0] - crop_size[3]) / 2)
-        crop_x = int((data.shape[1] - crop_size[4]) / 2)
+        crop_y = (data.shape[0] - crop_size[3]) // 2
+        crop_x = (data.shape[1] - crop_size[4]) // 2
         data = data[crop_y : crop_y + crop_size[3], crop_x : crop_x + crop_size[4], ...]
 
-    print("data shape after crop:")
-    print(data.shape)
+    logging.debug("data shape after crop: %s", data.shape)
 
     label_transform = _as_config_bool(
         mrdhelper.get_json_config_param(config, 'labeltransform', default=True, type='bool')
@@ -4511,7 +4535,11 @@ def process_image(
     if label_transform:
         logging.info("Applying label transformation: 3 * (label_in // 10) + (label_in % 10)")
         data = _transform_musclemap_label_values(data)
-        logging.info(f"Label transformation complete. New data range: [{data.min()}, {data.max()}]")
+
+    # Scan the final labels once; the maximum feeds the log and the output window
+    maxVal = int(np.max(data))
+    if label_transform:
+        logging.info("Label transformation complete. New maximum label: %d", maxVal)
 
     if compute_metrics and (metrics_burn_series or metrics_in_comments or metrics_in_minihead):
         try:
@@ -4566,36 +4594,30 @@ def process_image(
         logging.info("MuscleMap metrics computation disabled")
 
 
-    print("maximum value in segmented data before sending out:")
-    maxVal =  np.max(data)      
-    print(maxVal)
+    logging.debug("maximum value in segmented data before sending out: %s", maxVal)
 
     currentSeries = 0
 
-    # Re-slice back into 2D images
-    imagesOut = [None] * data.shape[-1]
+    # Re-slice back into 2D images, appended in slice order
+    imagesOut = []
 
-    print("data.shape before creating output images:")
-    print(data.shape)
+    logging.debug("data.shape before creating output images: %s", data.shape)
 
-    print("checking data type of data:")
-    print(data.dtype)
+    logging.debug("checking data type of data: %s", data.dtype)
 
     # check if data type is int16_t and if not convert it
     if data.dtype != np.int16:
-        i16 = np.iinfo(np.int16)
-        data_min = int(np.min(data))
-        data_max = int(np.max(data))
-        if data_min < i16.min or data_max > i16.max:
-            raise ValueError(f"Segmented labels [{data_min}, {data_max}] exceed int16 range")
+        if not np.can_cast(data.dtype, np.int16):
+            i16 = np.iinfo(np.int16)
+            data_min = int(np.min(data))
+            if data_min < i16.min or maxVal > i16.max:
+                raise ValueError(f"Segmented labels [{data_min}, {maxVal}] exceed int16 range")
         logging.info(f"Converting segmented data from {data.dtype} to int16")
         data = data.astype(np.int16, copy=False)
 
-    print("checking data type of final data:")
-    print(data.dtype)
+    logging.debug("checking data type of final data: %s", data.dtype)
 
-    print("header length - should be as many as images:")
-    print(len(head))
+    logging.debug("header length - should be as many as images: %s", len(head))
 
     if data.shape[-1] != len(head):
         raise ValueError(
@@ -4668,7 +4690,7 @@ def process_image(
         else:
             native_image_comment = source_image_label
         native_images = _build_native_ff_compose_images(
-            data,
+            data[:, :, None, None, :],
             head,
             output_slice_records,
             slice_axis,
@@ -4697,14 +4719,33 @@ def process_image(
             len(imagesOut),
         )
 
+    # Comment and meta attributes shared by every segmentation slice
+    if metrics_in_comments and metrics_comment:
+        image_comment = _join_image_comment(source_image_label, metrics_comment)
+    else:
+        image_comment = source_image_label
+
+    segmentation_shared_meta = {
+        "Keep_image_geometry": "1",
+        "WindowCenter": str((maxVal + 1) / 2),
+        "WindowWidth": str(maxVal + 1),
+        "partition_count": "1",
+        "slice_count": str(data.shape[-1]),
+        "NumberOfSlices": str(data.shape[-1]),
+        "ImagesInAcquisition": str(data.shape[-1]),
+    }
+
+    # Slices of a series normally share their in-plane directions, so each
+    # distinct direction is formatted once
+    formatted_directions = {}
+
     loop_indices = [] if native_images is not None else range(data.shape[-1])
     for iImg in loop_indices:
         # Create new MRD instance for the segmented image
-        # Transpose from convenience shape of [y x z cha] to MRD Image shape of [cha z y x]
         # from_array() should be called with 'transpose=False' to avoid warnings, and when called
         # with this option, can take input as: [cha z y x], [z y x], or [y x]
-        # imagesOut[iImg] = ismrmrd.Image.from_array(data[...,iImg].transpose((3, 2, 0, 1)), transpose=False)
-        imagesOut[iImg] = ismrmrd.Image.from_array(data[..., iImg].transpose((3, 2, 0, 1)), transpose=False)
+        image = ismrmrd.Image.from_array(data[:, :, iImg], transpose=False)
+        imagesOut.append(image)
 
         source_record = output_slice_records[iImg]
         source_image_index = int(getattr(head[iImg], "image_index", 0))
@@ -4714,7 +4755,7 @@ def process_image(
         # pyismrmrd versions expose getHead() as a live ctypes-backed object,
         # so mutating it can corrupt sendoriginal images.
         oldHeader = copy.deepcopy(head[iImg])
-        oldHeader.data_type = imagesOut[iImg].data_type
+        oldHeader.data_type = image.data_type
         _set_header_sequence_field(
             oldHeader,
             "matrix_size",
@@ -4739,7 +4780,7 @@ def process_image(
                 "slice_dir",
                 [float(value) for value in slice_axis],
             )
-        print(f"Image {iImg}: data_type = {imagesOut[iImg].data_type}")
+        logging.debug("Image %d: data_type = %s", iImg, image.data_type)
 
         # Supported ISMRMRD Data Types:
         #     ISMRMRD_USHORT   = 1, /**< corresponds to uint16_t */
@@ -4754,9 +4795,9 @@ def process_image(
         # ISMRMRD_CXDOUBLE = 8  /**< corresponds to complex double */
 
         # check if datatype is supported and if not show an error and stop:
-        if imagesOut[iImg].data_type not in [ismrmrd.DATATYPE_USHORT, ismrmrd.DATATYPE_SHORT, ismrmrd.DATATYPE_FLOAT, ismrmrd.DATATYPE_CXFLOAT]:
-            logging.error(f"Unsupported data type {imagesOut[iImg].data_type} in output image {iImg}. Supported types are: uint16, int16, float32, complex float32.")
-            raise ValueError(f"Unsupported data type {imagesOut[iImg].data_type} in output image {iImg}. Supported types are: uint16, int16, float32, complex float32.")
+        if image.data_type not in [ismrmrd.DATATYPE_USHORT, ismrmrd.DATATYPE_SHORT, ismrmrd.DATATYPE_FLOAT, ismrmrd.DATATYPE_CXFLOAT]:
+            logging.error(f"Unsupported data type {image.data_type} in output image {iImg}. Supported types are: uint16, int16, float32, complex float32.")
+            raise ValueError(f"Unsupported data type {image.data_type} in output image {iImg}. Supported types are: uint16, int16, float32, complex float32.")
 
         # Increment series number when flag detected (i.e. follow ICE logic for splitting series)
         if mrdhelper.get_meta_value(meta[iImg], "IceMiniHead") is not None:
@@ -4768,33 +4809,20 @@ def process_image(
             ):
                 currentSeries += 1
 
-        if metrics_in_comments and metrics_comment:
-            image_comment = _join_image_comment(source_image_label, metrics_comment)
-        else:
-            image_comment = source_image_label
+        row_dir = tuple(oldHeader.read_dir)
+        column_dir = tuple(oldHeader.phase_dir)
+        for direction in (row_dir, column_dir):
+            if direction not in formatted_directions:
+                formatted_directions[direction] = _format_meta_vector(direction)
 
         segmentation_extra_meta = {
-            "Keep_image_geometry": "1",
-            "WindowCenter": str((maxVal + 1) / 2),
-            "WindowWidth": str(maxVal + 1),
-            "partition_count": "1",
-            "slice_count": str(data.shape[-1]),
-            "NumberOfSlices": str(data.shape[-1]),
-            "ImagesInAcquisition": str(data.shape[-1]),
+            **segmentation_shared_meta,
             "MuscleMapSourceInputIndex": str(source_record["input_index"]),
             "MuscleMapSourceImageIndex": str(source_image_index),
             "MuscleMapSourceSlice": str(source_slice_index),
             "MuscleMapSourceProjectedPosition": f"{source_record['projected_position']:.6f}",
-            "ImageRowDir": [
-                "{:.18f}".format(oldHeader.read_dir[0]),
-                "{:.18f}".format(oldHeader.read_dir[1]),
-                "{:.18f}".format(oldHeader.read_dir[2]),
-            ],
-            "ImageColumnDir": [
-                "{:.18f}".format(oldHeader.phase_dir[0]),
-                "{:.18f}".format(oldHeader.phase_dir[1]),
-                "{:.18f}".format(oldHeader.phase_dir[2]),
-            ],
+            "ImageRowDir": list(formatted_directions[row_dir]),
+            "ImageColumnDir": list(formatted_directions[column_dir]),
         }
         if segmentation_colormap:
             segmentation_extra_meta["LUTFileName"] = "MicroDeltaHotMetal.pal"
@@ -4804,7 +4832,7 @@ def process_image(
             # ExamDataRole post-processing-child tag, which is precisely what
             # excludes the default segment from the inline composer).
             _stamp_output_image(
-                imagesOut[iImg],
+                image,
                 oldHeader,
                 meta[iImg],
                 compose_identity,
@@ -4820,7 +4848,7 @@ def process_image(
             )
         else:
             _stamp_output_image(
-                imagesOut[iImg],
+                image,
                 oldHeader,
                 meta[iImg],
                 segmentation_identity,
@@ -4835,13 +4863,13 @@ def process_image(
                 source_geometry_segment=True,
             )
 
-        metaXml = imagesOut[iImg].attribute_string
+        metaXml = image.attribute_string
         # logging.debug("Image MetaAttributes: %s", xml.dom.minidom.parseString(metaXml).toprettyxml())
-        # logging.debug("Image data has %d elements", imagesOut[iImg].data.size)
+        # logging.debug("Image data has %d elements", image.data.size)
 
         if iImg in set(_sample_indices(data.shape[-1], edge_count=6)):
-            final_meta = ismrmrd.Meta.deserialize(metaXml)
-            final_header = imagesOut[iImg].getHead()
+            final_meta = _deserialize_meta(metaXml)
+            final_header = image.getHead()
             final_minihead = _decode_ice_minihead(final_meta)
             _log_json_event(
                 "MUSCLEMAP_OUTPUT_IDENTITY",
@@ -4888,7 +4916,7 @@ def process_image(
                 int(np.count_nonzero(data[..., iImg])),
             )
 
-    segmentation_output_metas = [ismrmrd.Meta.deserialize(image.attribute_string) for image in imagesOut]
+    segmentation_output_metas = [_deserialize_meta(image.attribute_string) for image in imagesOut]
     segmentation_source_input_indices = []
     for index, meta_obj in enumerate(segmentation_output_metas):
         source_input_index = _get_first_meta_int(meta_obj, ["MuscleMapSourceInputIndex"])
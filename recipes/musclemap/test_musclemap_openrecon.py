@@ -1,6 +1,7 @@
 import ast
 import base64
 import copy
+import functools
 import json
 import re
 from pathlib import Path
@@ -94,6 +95,7 @@ def _load_runtime_helpers_for_test(function_names, assignments=()):
     namespace = {
         "base64": base64,
         "copy": copy,
+        "functools": functools,
         "ismrmrd": FakeIsmrmrd,
         "json": json,
         "logging": type(
@@ -303,6 +305,33 @@ def test_metrics_label_transform_restores_original_ids_for_anatomy_lookup():
     assert helpers["_metrics_label_scale_name"](False) == "native"
 
 
+def test_label_transform_lookup_keeps_dtype_and_layout():
+    helpers = _load_runtime_helpers_for_test(["_transform_musclemap_label_values"])
+    transform = helpers["_transform_musclemap_label_values"]
+
+    # NIfTI labels load in Fortran order and are viewed as [y, x, z].
+    labels = np.asfortranarray(
+        np.array(
+            [
+                [[0, 1101], [1102, 1120]],
+                [[1121, 1122], [0, 31]],
+            ],
+            dtype=np.int16,
+        )
+    ).transpose((1, 0, 2))
+    transformed = transform(labels)
+    wide = labels.astype(np.int64)
+    np.testing.assert_array_equal(transformed, 3 * (wide // 10) + (wide % 10))
+    assert transformed.dtype == np.int16
+    assert transformed.shape == labels.shape
+    # Each output image is built from a [y, x] plane, which must stay C-contiguous.
+    for index in range(transformed.shape[-1]):
+        assert transformed[:, :, index].flags["C_CONTIGUOUS"]
+
+    small_labels = np.array([0, 1, 2, 9], dtype=np.uint8)
+    np.testing.assert_array_equal(transform(small_labels), small_labels)
+
+
 def test_dixon_segmentation_selection_defaults_to_opposed_phase_and_supports_multi_select():
     helpers = _load_runtime_helpers_for_test(
         [
@@ -634,6 +663,8 @@ def test_original_restamp_preserves_source_native_geometry_and_processing_identi
             "_build_passthrough_output_identity",
             "_clone_mrd_image",
             "_copy_meta",
+            "_deserialize_meta",
+            "_parse_meta_cached",
             "_decode_ice_minihead",
             "_encode_ice_minihead",
             "_extract_dicom_image_type_values",
@@ -768,6 +799,8 @@ def test_segmentation_stamp_uses_2d_source_geometry_identity():
         [
             "_build_derived_sop_instance_uid",
             "_copy_meta",
+            "_deserialize_meta",
+            "_parse_meta_cached",
             "_decode_ice_minihead",
             "_encode_ice_minihead",
             "_extract_dicom_image_type_values",
@@ -931,6 +964,7 @@ def test_metrics_report_image_matches_openreconi2iexample_explicit_volume_contra
             "_chunk_list",
             "_copy_meta",
             "_decode_ice_minihead",
+            "_deserialize_meta",
             "_explicit_header_geometry_meta",
             "_extract_dicom_image_type_values",
             "_extract_minihead_array_tokens",
@@ -950,6 +984,7 @@ def test_metrics_report_image_matches_openreconi2iexample_explicit_volume_contra
             "_metrics_rows",
             "_orient_metrics_report_page",
             "_output_meta",
+            "_parse_meta_cached",
             "_pil_text_size",
             "_render_metrics_report_pages",
             "_set_header_sequence_field",
@@ -1185,11 +1220,13 @@ def test_output_storage_contract_rejects_duplicate_scanner_storage_key():
         [
             "_as_image_list",
             "_decode_ice_minihead",
+            "_deserialize_meta",
             "_extract_minihead_long_value",
             "_extract_minihead_string_value",
             "_first_non_empty_text",
             "_get_first_meta_int",
             "_get_meta_text",
+            "_parse_meta_cached",
             "_validate_output_storage_contract",
         ],
         assignments=[
@@ -1227,11 +1264,13 @@ def test_output_storage_contract_rejects_nonzero_partition_counters():
         [
             "_as_image_list",
             "_decode_ice_minihead",
+            "_deserialize_meta",
             "_extract_minihead_long_value",
             "_extract_minihead_string_value",
             "_first_non_empty_text",
             "_get_first_meta_int",
             "_get_meta_text",
+            "_parse_meta_cached",
             "_validate_output_storage_contract",
         ],
         assignments=[
@@ -1315,6 +1354,8 @@ def test_compose_target_detection_matches_only_fat_fraction():
             "_get_meta_text",
             "_first_non_empty_text",
             "_meta_text_values",
+            "_deserialize_meta",
+            "_parse_meta_cached",
         ],
         assignments=["composeFatFractionTokenAliases"],
     )
@@ -1361,6 +1402,8 @@ def test_compose_stamp_uses_fat_fraction_identity_without_postprocessing_child()
         [
             "_build_derived_sop_instance_uid",
             "_copy_meta",
+            "_deserialize_meta",
+            "_parse_meta_cached",
             "_decode_ice_minihead",
             "_encode_ice_minihead",
             "_extract_dicom_image_type_values",
@@ -1544,6 +1587,8 @@ def test_build_native_ff_compose_images_reuses_carrier_identity_and_swaps_pixels
             "_project_position_along_axis",
             "_header_vector",
             "_copy_meta",
+            "_deserialize_meta",
+            "_parse_meta_cached",
             "_set_meta_scalar",
             "_get_first_meta_int",
             "_is_native_ff_compose_image",
@@ -1640,6 +1685,8 @@ def test_build_native_ff_compose_images_falls_back_when_no_carrier_for_each_slic
             "_project_position_along_axis",
             "_header_vector",
             "_copy_meta",
+            "_deserialize_meta",
+            "_parse_meta_cached",
             "_set_meta_scalar",
             "_get_first_meta_int",
             "_first_non_empty_text",
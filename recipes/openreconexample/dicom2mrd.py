@@ -1,4 +1,7 @@
 import pydicom
+from pydicom.dataelem import RawDataElement
+from pydicom.multival import MultiValue
+from pydicom.uid import EnhancedMRImageStorage
 import argparse
 import ismrmrd
 import numpy as np
@@ -6,6 +9,9 @@ import os
 import ctypes
 import re
 import base64
+import collections
+import concurrent.futures
+import functools
 
 # Defaults for input arguments
 defaults = {
@@ -28,9 +34,20 @@ venc_dir_map = {'rl'  : 'FLOW_DIR_R_TO_L',
                 'in'  : 'FLOW_DIR_TP_IN',
                 'out' : 'FLOW_DIR_TP_OUT'}
 
+# DICOM TM values: HHMMSS with optional fractional seconds
+acq_time_re = re.compile(r'(\d{2})(\d{2})(\d{2})(\.\d+)?$')
+
+# Siemens flow sequence names end in _v<velocity><direction>, e.g. fl2d1_v150in
+venc_re = re.compile(r'_v(?P<vel>\d+)(?P<dir>[^\d]*)$')
+
+# Tags needed to group and sort the files before the full header and pixel data are read
+sort_tags = ['SOPClassUID', 'SeriesNumber', 'InstanceNumber', 'SliceLocation', 'TriggerTime',
+             'ImagePositionPatient', 'ImageOrientationPatient', 'PixelSpacing', 'SliceThickness', 'Rows', 'Columns',
+             'PerFrameFunctionalGroupsSequence', 'SharedFunctionalGroupsSequence']
+
 
 def _is_enhanced_mr(dset):
-    return dset.SOPClassUID.name == 'Enhanced MR Image Storage'
+    return ('SOPClassUID' in dset) and (dset.SOPClassUID == EnhancedMRImageStorage)
 
 
 def _normalize(vec):
@@ -41,21 +58,40 @@ def _normalize(vec):
     return arr / norm
 
 
+def _get_ds(dset, keyword, default=None):
+    """Get a decimal string (DS) element as a float array, or default if it is absent or empty"""
+    elem = dset.get_item(keyword)
+    if elem is None:
+        return default
+
+    # Elements that pydicom has not converted yet are parsed straight from their raw bytes,
+    # which avoids building a DSfloat for every value.  Empty components (e.g. b'1.0\\')
+    # are skipped, and anything else the fast parse rejects is left to pydicom.
+    if isinstance(elem, RawDataElement):
+        if elem.value is not None:
+            values = [value for value in elem.value.split(b'\\') if value.strip()]
+            try:
+                return np.array(values, dtype=float) if values else default
+            except ValueError:
+                pass
+        elem = dset[keyword]
+
+    value = elem.value
+    if not isinstance(value, (list, tuple, MultiValue)):
+        value = [value]
+    values = [item for item in value if (item is not None) and (item != '')]
+    if not values:
+        return default
+    return np.array(values, dtype=float)
+
+
 def _get_enhanced_group_item(dset, group_name):
     if not _is_enhanced_mr(dset):
         return None
 
-    try:
-        if group_name in dset.PerFrameFunctionalGroupsSequence[0]:
-            return dset.PerFrameFunctionalGroupsSequence[0][group_name][0]
-    except Exception:
-        pass
-
-    try:
-        if group_name in dset.SharedFunctionalGroupsSequence[0]:
-            return dset.SharedFunctionalGroupsSequence[0][group_name][0]
-    except Exception:
-        pass
+    for groups in (dset.get('PerFrameFunctionalGroupsSequence'), dset.get('SharedFunctionalGroupsSequence')):
+        if groups and (group_name in groups[0]) and groups[0][group_name].value:
+            return groups[0][group_name][0]
 
     return None
 
@@ -67,17 +103,17 @@ def _get_pixel_spacing_and_thickness(dset):
     if _is_enhanced_mr(dset):
         measures = _get_enhanced_group_item(dset, 'PixelMeasuresSequence')
         if measures is not None:
-            pixel_spacing = getattr(measures, 'PixelSpacing', None)
-            slice_thickness = getattr(measures, 'SliceThickness', None)
+            pixel_spacing = _get_ds(measures, 'PixelSpacing')
+            slice_thickness = _get_ds(measures, 'SliceThickness')
 
     if pixel_spacing is None:
-        pixel_spacing = dset.get('PixelSpacing', [1.0, 1.0])
+        pixel_spacing = _get_ds(dset, 'PixelSpacing', [1.0, 1.0])
     if slice_thickness is None:
-        slice_thickness = dset.get('SliceThickness', 1.0)
+        slice_thickness = _get_ds(dset, 'SliceThickness', [1.0])
 
     row_spacing = float(pixel_spacing[0])
     col_spacing = float(pixel_spacing[1])
-    return row_spacing, col_spacing, float(slice_thickness)
+    return row_spacing, col_spacing, float(slice_thickness[0])
 
 
 def _get_image_orientation(dset):
@@ -86,18 +122,29 @@ def _get_image_orientation(dset):
     if _is_enhanced_mr(dset):
         orient = _get_enhanced_group_item(dset, 'PlaneOrientationSequence')
         if orient is not None:
-            iop = getattr(orient, 'ImageOrientationPatient', None)
+            iop = _get_ds(orient, 'ImageOrientationPatient')
 
     if iop is None:
-        iop = dset.get('ImageOrientationPatient', [1.0, 0.0, 0.0, 0.0, 1.0, 0.0])
+        iop = _get_ds(dset, 'ImageOrientationPatient', [1.0, 0.0, 0.0, 0.0, 1.0, 0.0])
 
     iop = np.asarray(iop, dtype=float)
     if iop.size != 6:
         iop = np.asarray([1.0, 0.0, 0.0, 0.0, 1.0, 0.0], dtype=float)
 
+    return _get_directions(tuple(iop.tolist()))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_directions(iop):
+    """Row, column and slice directions for an orientation, which is usually shared by a whole series"""
     row_dir = _normalize(iop[0:3])
     col_dir = _normalize(iop[3:6])
-    return row_dir, col_dir
+    slice_dir = _normalize(np.cross(row_dir, col_dir))
+
+    # The cached arrays are shared between datasets
+    for vec in (row_dir, col_dir, slice_dir):
+        vec.setflags(write=False)
+    return row_dir, col_dir, slice_dir
 
 
 def _get_image_position(dset):
@@ -106,10 +153,10 @@ def _get_image_position(dset):
     if _is_enhanced_mr(dset):
         position = _get_enhanced_group_item(dset, 'PlanePositionSequence')
         if position is not None:
-            ipp = getattr(position, 'ImagePositionPatient', None)
+            ipp = _get_ds(position, 'ImagePositionPatient')
 
     if ipp is None:
-        ipp = dset.get('ImagePositionPatient', [0.0, 0.0, 0.0])
+        ipp = _get_ds(dset, 'ImagePositionPatient', [0.0, 0.0, 0.0])
 
     ipp = np.asarray(ipp, dtype=float)
     if ipp.size != 3:
@@ -118,36 +165,63 @@ def _get_image_position(dset):
     return ipp
 
 
-def _get_slice_location(dset):
-    row_dir, col_dir = _get_image_orientation(dset)
-    slice_dir = _normalize(np.cross(row_dir, col_dir))
-    if np.linalg.norm(slice_dir) == 0:
-        return float(dset.get('SliceLocation', 0.0))
-
+def _get_geometry(dset):
+    """Field of view, orientation, position and slice location of a dataset"""
+    row_spacing, col_spacing, slice_thickness = _get_pixel_spacing_and_thickness(dset)
+    field_of_view = (col_spacing*dset.Columns, row_spacing*dset.Rows, slice_thickness)
+    row_dir, col_dir, slice_dir = _get_image_orientation(dset)
     position = _get_image_position(dset)
-    return float(np.dot(position, slice_dir))
+    if np.linalg.norm(slice_dir) == 0:
+        slice_loc = float(dset.get('SliceLocation', 0.0))
+    else:
+        slice_loc = float(np.dot(position, slice_dir))
+    return field_of_view, row_dir, col_dir, slice_dir, position, slice_loc
 
 
-def _closest_index(values, value):
-    arr = np.asarray(values, dtype=float)
-    if arr.size == 0:
-        return 0
-    return int(np.argmin(np.abs(arr - float(value))))
+@functools.lru_cache(maxsize=None)
+def _parse_venc(sequence_name):
+    """Flow velocity and MRD flow direction (None if unknown) encoded in a sequence name, or None"""
+    match = venc_re.search(sequence_name)
+    if match is None:
+        return None
+    return float(match['vel']), venc_dir_map.get(match['dir'])
 
 
+@functools.lru_cache(maxsize=None)
 def _parse_acquisition_time_ms(acq_time):
-    acq_time = str(acq_time).strip()
-    if len(acq_time) < 6:
+    match = acq_time_re.match(str(acq_time).strip())
+    if match is None:
         return 0
 
-    try:
-        h = int(acq_time[0:2])
-        m = int(acq_time[2:4])
-        s = int(acq_time[4:6])
-        frac = float(acq_time[6:]) if len(acq_time) > 6 else 0.0
-        return round((h*3600 + m*60 + s + frac) * 1000 / 2.5)
-    except Exception:
-        return 0
+    h = int(match[1])
+    m = int(match[2])
+    s = int(match[3])
+    frac = float(match[4]) if match[4] else 0.0
+    return round((h*3600 + m*60 + s + frac) * 1000 / 2.5)
+
+
+def _read_dicom(path, series_number):
+    """Read a DICOM file, decode its pixel data and encode the rest of its header as base64 JSON"""
+    dset = pydicom.dcmread(path)
+    pixel_array = dset.pixel_array
+
+    # Release the encoded pixel data (all frames for multi-frame files) as soon as it is decoded
+    del dset['PixelData']
+
+    dset.SeriesNumber = series_number
+    dicom_json = base64.b64encode(dset.to_json().encode('utf-8')).decode('utf-8')
+    return dset, pixel_array, dicom_json
+
+
+def _prefetch(executor, func, items, depth):
+    """Like executor.map, but with at most depth calls in flight so results don't pile up in memory"""
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
 
 def CreateMrdHeader(dset):
@@ -164,18 +238,14 @@ def CreateMrdHeader(dset):
     mrdHead.acquisitionSystemInformation                       = ismrmrd.xsd.acquisitionSystemInformationType()
     mrdHead.acquisitionSystemInformation.systemVendor          = dset.Manufacturer
     mrdHead.acquisitionSystemInformation.systemModel           = dset.ManufacturerModelName
-    mrdHead.acquisitionSystemInformation.systemFieldStrength_T = float(dset.MagneticFieldStrength)
-    try:
-        mrdHead.acquisitionSystemInformation.institutionName       = dset.InstitutionName
-    except:
-        mrdHead.acquisitionSystemInformation.institutionName       = 'Virtual'
-    try:
+    field_strength                                             = float(_get_ds(dset, 'MagneticFieldStrength')[0])
+    mrdHead.acquisitionSystemInformation.systemFieldStrength_T = field_strength
+    mrdHead.acquisitionSystemInformation.institutionName       = dset.get('InstitutionName', 'Virtual')
+    if 'StationName' in dset:
         mrdHead.acquisitionSystemInformation.stationName       = dset.StationName
-    except:
-        pass
 
     mrdHead.experimentalConditions                             = ismrmrd.xsd.experimentalConditionsType()
-    mrdHead.experimentalConditions.H1resonanceFrequency_Hz     = int(dset.MagneticFieldStrength*4258e4)
+    mrdHead.experimentalConditions.H1resonanceFrequency_Hz     = int(field_strength*4258e4)
 
     enc = ismrmrd.xsd.encodingType()
     enc.trajectory                                              = ismrmrd.xsd.trajectoryType('cartesian')
@@ -196,17 +266,13 @@ def CreateMrdHeader(dset):
     enc.parallelImaging                                         = ismrmrd.xsd.parallelImagingType()
 
     enc.parallelImaging.accelerationFactor                      = ismrmrd.xsd.accelerationFactorType()
+    enc.parallelImaging.accelerationFactor.kspace_encoding_step_1 = 1
+    enc.parallelImaging.accelerationFactor.kspace_encoding_step_2 = 1
     if _is_enhanced_mr(dset):
-        try:
-            mod = dset.SharedFunctionalGroupsSequence[0].MRModifierSequence[0]
-            enc.parallelImaging.accelerationFactor.kspace_encoding_step_1 = mod.ParallelReductionFactorInPlane
-            enc.parallelImaging.accelerationFactor.kspace_encoding_step_2 = mod.ParallelReductionFactorOutOfPlane
-        except Exception:
-            enc.parallelImaging.accelerationFactor.kspace_encoding_step_1 = 1
-            enc.parallelImaging.accelerationFactor.kspace_encoding_step_2 = 1
-    else:
-        enc.parallelImaging.accelerationFactor.kspace_encoding_step_1 = 1
-        enc.parallelImaging.accelerationFactor.kspace_encoding_step_2 = 1
+        mod = _get_enhanced_group_item(dset, 'MRModifierSequence')
+        if mod is not None:
+            enc.parallelImaging.accelerationFactor.kspace_encoding_step_1 = mod.get('ParallelReductionFactorInPlane', 1)
+            enc.parallelImaging.accelerationFactor.kspace_encoding_step_2 = mod.get('ParallelReductionFactorOutOfPlane', 1)
 
     mrdHead.encoding.append(enc)
 
@@ -216,152 +282,172 @@ def CreateMrdHeader(dset):
 
 def GetDicomFiles(directory):
     """Get path to all DICOMs in a directory and its sub-directories"""
-    for entry in os.scandir(directory):
-        if entry.is_file() and (entry.path.lower().endswith(".dcm") or entry.path.lower().endswith(".ima")):
-            yield entry.path
-        elif entry.is_dir():
-            yield from GetDicomFiles(entry.path)
+    for root, _, files in os.walk(directory, followlinks=True):
+        for name in files:
+            if name.lower().endswith(('.dcm', '.ima')):
+                yield os.path.join(root, name)
 
 
 def main(args):
-    dsetsAll = []
-    for entryPath in GetDicomFiles(args.folder):
-        dsetsAll.append(pydicom.dcmread(entryPath))
+    # Parsing is independent per file, so spread it over all cores.  Only the tags needed for
+    # grouping and sorting are read here; each file is read in full when its image is created.
+    # Large values (e.g. the per-frame functional groups of Enhanced MR files) are deferred, so
+    # they are neither read nor sent back from the workers unless the geometry lookup needs them.
+    paths = list(GetDicomFiles(args.folder))
+    read_sort_tags = functools.partial(pydicom.dcmread, stop_before_pixels=True, specific_tags=sort_tags, defer_size='4 KB')
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        dsetsAll = list(executor.map(read_sort_tags, paths, chunksize=16))
 
     # Group by series number
-    uSeriesNum = np.unique([dset.SeriesNumber for dset in dsetsAll])
+    series = collections.defaultdict(list)
+    for dset in dsetsAll:
+        series[int(dset.SeriesNumber)].append(dset)
 
     # Re-group series that were split during conversion from multi-frame to single-frame DICOMs
-    if all(uSeriesNum > 1000):
-        for i in range(len(dsetsAll)):
-            dsetsAll[i].SeriesNumber = int(np.floor(dsetsAll[i].SeriesNumber / 1000))
-    uSeriesNum = np.unique([dset.SeriesNumber for dset in dsetsAll])
+    seriesDivisor = 1
+    if all(seriesNum > 1000 for seriesNum in series):
+        seriesDivisor = 1000
+        series = collections.defaultdict(list)
+        for dset in dsetsAll:
+            series[int(dset.SeriesNumber) // seriesDivisor].append(dset)
+    uSeriesNum = sorted(series)
 
     print("Found %d unique series from %d files in folder %s" % (len(uSeriesNum), len(dsetsAll), args.folder))
 
-    print("Creating MRD XML header from file %s" % dsetsAll[0].filename)
-    mrdHead = CreateMrdHeader(dsetsAll[0])
-    print(mrdHead.toXML())
-
-    imgAll = [None]*len(uSeriesNum)
-
-    for iSer in range(len(uSeriesNum)):
-        dsets = [dset for dset in dsetsAll if dset.SeriesNumber == uSeriesNum[iSer]]
-
-        imgAll[iSer] = [None]*len(dsets)
-
-        # Sort images by instance number, as they may be read out of order
-        def get_instance_number(item):
-            return item.InstanceNumber
-        dsets = sorted(dsets, key=get_instance_number)
-
-        # Build a list of unique geometric slice locations and trigger times.
-        # SliceLocation can be absent/inconsistent; project ImagePositionPatient onto slice normal.
-        slice_locs = np.asarray([_get_slice_location(dset) for dset in dsets], dtype=float)
-        uSliceLoc = np.unique(slice_locs)
-        if (uSliceLoc.size > 1) and (not np.isclose(slice_locs[0], uSliceLoc[0])):
-            uSliceLoc = uSliceLoc[::-1]
-
-        try:
-            # This field may not exist for non-gated sequences
-            trig_times = np.asarray([float(dset.TriggerTime) for dset in dsets], dtype=float)
-            uTrigTime = np.unique(trig_times)
-            if (uTrigTime.size > 1) and (not np.isclose(trig_times[0], uTrigTime[0])):
-                uTrigTime = uTrigTime[::-1]
-        except Exception:
-            trig_times = np.zeros(len(dsets), dtype=float)
-            uTrigTime = np.asarray([0.0], dtype=float)
-
-        print("Series %d has %d images with %d slices and %d phases" % (uSeriesNum[iSer], len(dsets), len(uSliceLoc), len(uTrigTime)))
-
-        for iImg in range(len(dsets)):
-            tmpDset = dsets[iImg]
-
-            # Create new MRD image instance.
-            # pixel_array data has shape [row col], i.e. [y x].
-            # from_array() should be called with 'transpose=False' to avoid warnings, and when called
-            # with this option, can take input as: [cha z y x], [z y x], or [y x]
-            tmpMrdImg = ismrmrd.Image.from_array(tmpDset.pixel_array, transpose=False)
-            tmpMeta   = ismrmrd.Meta()
-
-            try:
-                tmpMrdImg.image_type                = imtype_map[tmpDset.ImageType[2]]
-            except:
-                print("Unsupported ImageType %s -- defaulting to IMTYPE_MAGNITUDE" % tmpDset.ImageType[2])
-                tmpMrdImg.image_type                = ismrmrd.IMTYPE_MAGNITUDE
-
-            row_spacing, col_spacing, slice_thickness = _get_pixel_spacing_and_thickness(tmpDset)
-            row_dir, col_dir = _get_image_orientation(tmpDset)
-            slice_dir = _normalize(np.cross(row_dir, col_dir))
-            image_position = _get_image_position(tmpDset)
-
-            tmpMrdImg.field_of_view            = (col_spacing*tmpDset.Columns, row_spacing*tmpDset.Rows, slice_thickness)
-            tmpMrdImg.position                 = tuple(image_position)
-
-            # Keep MRD direction mapping consistent with musclemap/enhanceddicom2mrd:
-            # read_dir follows DICOM row direction, phase_dir follows DICOM column direction.
-            tmpMrdImg.read_dir                 = tuple(row_dir)
-            tmpMrdImg.phase_dir                = tuple(col_dir)
-            tmpMrdImg.slice_dir                = tuple(slice_dir)
-            tmpMrdImg.acquisition_time_stamp   = _parse_acquisition_time_ms(tmpDset.get('AcquisitionTime', '000000.0'))
-            try:
-                tmpMrdImg.physiology_time_stamp[0] = round(int(tmpDset.TriggerTime/2.5))
-            except:
-                pass
-
-            try:
-                ImaAbsTablePosition = tmpDset.get_private_item(0x0019, 0x13, 'SIEMENS MR HEADER').value
-                tmpMrdImg.patient_table_position = (ctypes.c_float(ImaAbsTablePosition[0]), ctypes.c_float(ImaAbsTablePosition[1]), ctypes.c_float(ImaAbsTablePosition[2]))
-            except:
-                pass
-
-            tmpMrdImg.image_series_index     = uSeriesNum.tolist().index(tmpDset.SeriesNumber)
-            tmpMrdImg.image_index            = tmpDset.get('InstanceNumber', 0)
-            tmpMrdImg.slice                  = _closest_index(uSliceLoc, slice_locs[iImg])
-            try:
-                tmpMrdImg.phase              = _closest_index(uTrigTime, trig_times[iImg])
-            except Exception:
-                tmpMrdImg.phase              = 0
-
-            try:
-                res  = re.search(r'(?<=_v).*$',     tmpDset.SequenceName)
-                venc = re.search(r'^\d+',           res.group(0))
-                dir  = re.search(r'(?<=\d)[^\d]*$', res.group(0))
-
-                tmpMeta['FlowVelocity']   = float(venc.group(0))
-                tmpMeta['FlowDirDisplay'] = venc_dir_map[dir.group(0)]
-            except:
-                pass
-
-            try:
-                tmpMeta['ImageComments'] = tmpDset.ImageComments
-            except:
-                pass
-
-            tmpMeta['SequenceDescription'] = tmpDset.SeriesDescription
+    # The header comes from the full read of the first file, which is then kept until its image is built
+    firstPath = dsetsAll[0].filename
+    preloaded = {firstPath: _read_dicom(firstPath, int(dsetsAll[0].SeriesNumber) // seriesDivisor)}
 
-            # Remove pixel data from pydicom class
-            del tmpDset['PixelData']
+    print("Creating MRD XML header from file %s" % firstPath)
+    mrdHead = CreateMrdHeader(preloaded[firstPath][0])
+    mrdHeadXml = mrdHead.toXML()
+    print(mrdHeadXml)
 
-            # Store the complete base64, json-formatted DICOM header so that non-MRD fields can be
-            # recapitulated when generating DICOMs from MRD images
-            tmpMeta['DicomJson'] = base64.b64encode(tmpDset.to_json().encode('utf-8')).decode('utf-8')
-
-            tmpMrdImg.attribute_string = tmpMeta.serialize()
-            imgAll[iSer][iImg] = tmpMrdImg
-
-    # Create an MRD file
+    # Create an MRD file and write images as they are built, rather than holding them all in memory
     print("Creating MRD file %s with group %s" % (args.outFile, args.outGroup))
     mrdDset = ismrmrd.Dataset(args.outFile, args.outGroup)
     mrdDset._file.require_group(args.outGroup)
 
     # Write MRD Header
-    mrdDset.write_xml_header(bytes(mrdHead.toXML(), 'utf-8'))
+    mrdDset.write_xml_header(mrdHeadXml.encode('utf-8'))
+
+    # Images are appended by a single writer thread (h5py is not thread-safe), so HDF5 writes
+    # overlap with building the next images.  A few writes are kept in flight to bound memory.
+    # Leaving the executors waits for any reads and writes still in flight, also when a series fails
+    with concurrent.futures.ThreadPoolExecutor() as reader, \
+         concurrent.futures.ThreadPoolExecutor(max_workers=1) as writer:
+        pending_writes = collections.deque()
+
+        for iSer in range(len(uSeriesNum)):
+            dsets = series[uSeriesNum[iSer]]
+
+            # Sort images by instance number, as they may be read out of order
+            def get_instance_number(item):
+                return item.InstanceNumber
+            dsets = sorted(dsets, key=get_instance_number)
+
+            # Build a list of unique geometric slice locations and trigger times.
+            # SliceLocation can be absent/inconsistent; project ImagePositionPatient onto slice normal.
+            # The geometry of each image is computed once here and reused when its header is filled.
+            geometries = [_get_geometry(dset) for dset in dsets]
+            slice_locs = np.asarray([geometry[5] for geometry in geometries], dtype=float)
+            uSliceLoc = np.unique(slice_locs)
+            if (uSliceLoc.size > 1) and (not np.isclose(slice_locs[0], uSliceLoc[0])):
+                uSliceLoc = uSliceLoc[::-1]
 
-    # Write all images
-    for iSer in range(len(imgAll)):
-        for iImg in range(len(imgAll[iSer])):
-            mrdDset.append_image("image_%d" % imgAll[iSer][iImg].image_series_index, imgAll[iSer][iImg])
+            # This field may not exist for non-gated sequences
+            trigger_times = [_get_ds(dset, 'TriggerTime') for dset in dsets]
+            if all(trigger_time is not None for trigger_time in trigger_times):
+                trig_times = np.asarray([trigger_time[0] for trigger_time in trigger_times], dtype=float)
+                uTrigTime = np.unique(trig_times)
+                if (uTrigTime.size > 1) and (not np.isclose(trig_times[0], uTrigTime[0])):
+                    uTrigTime = uTrigTime[::-1]
+            else:
+                trig_times = np.zeros(len(dsets), dtype=float)
+                uTrigTime = np.asarray([0.0], dtype=float)
+
+            # Every location/time is an element of its unique list, so index them with exact lookups
+            slice_index = {loc: i for i, loc in enumerate(uSliceLoc.tolist())}
+            phase_index = {t: i for i, t in enumerate(uTrigTime.tolist())}
+
+            # Pixel decoding mostly runs in C, so read ahead a few images on threads
+            def read_image(path, series_number=uSeriesNum[iSer]):
+                image = preloaded.pop(path, None)
+                if image is None:
+                    image = _read_dicom(path, series_number)
+                return image
+            images = _prefetch(reader, read_image, [dset.filename for dset in dsets], 2*os.cpu_count())
+
+            image_group = "image_%d" % iSer
+
+            print("Series %d has %d images with %d slices and %d phases" % (uSeriesNum[iSer], len(dsets), len(uSliceLoc), len(uTrigTime)))
+
+            for iImg in range(len(dsets)):
+                tmpDset, pixel_array, dicom_json = next(images)
+
+                # Create new MRD image instance.
+                # pixel_array data has shape [row col], i.e. [y x].
+                # from_array() should be called with 'transpose=False' to avoid warnings, and when called
+                # with this option, can take input as: [cha z y x], [z y x], or [y x]
+                tmpMrdImg = ismrmrd.Image.from_array(pixel_array, transpose=False)
+                tmpMeta   = ismrmrd.Meta()
+
+                image_type = tmpDset.get('ImageType', [])
+                if (len(image_type) > 2) and (image_type[2] in imtype_map):
+                    tmpMrdImg.image_type                = imtype_map[image_type[2]]
+                else:
+                    print("Unsupported ImageType %s -- defaulting to IMTYPE_MAGNITUDE" % (image_type[2] if len(image_type) > 2 else image_type))
+                    tmpMrdImg.image_type                = ismrmrd.IMTYPE_MAGNITUDE
+
+                field_of_view, row_dir, col_dir, slice_dir, image_position, _ = geometries[iImg]
+
+                tmpMrdImg.field_of_view            = field_of_view
+                tmpMrdImg.position                 = tuple(image_position)
+
+                # Keep MRD direction mapping consistent with musclemap/enhanceddicom2mrd:
+                # read_dir follows DICOM row direction, phase_dir follows DICOM column direction.
+                tmpMrdImg.read_dir                 = tuple(row_dir)
+                tmpMrdImg.phase_dir                = tuple(col_dir)
+                tmpMrdImg.slice_dir                = tuple(slice_dir)
+                tmpMrdImg.acquisition_time_stamp   = _parse_acquisition_time_ms(tmpDset.get('AcquisitionTime', '000000.0'))
+                if trigger_times[iImg] is not None:
+                    tmpMrdImg.physiology_time_stamp[0] = round(int(trigger_times[iImg][0]/2.5))
+
+                if 'SIEMENS MR HEADER' in tmpDset.private_creators(0x0019):
+                    siemens_header = tmpDset.private_block(0x0019, 'SIEMENS MR HEADER')
+                    # Only a three-valued position is usable; VM 1 or undecoded (UN) values are skipped
+                    if (0x13 in siemens_header) and (siemens_header[0x13].VM == 3):
+                        ImaAbsTablePosition = siemens_header[0x13].value
+                        tmpMrdImg.patient_table_position = (ctypes.c_float(ImaAbsTablePosition[0]), ctypes.c_float(ImaAbsTablePosition[1]), ctypes.c_float(ImaAbsTablePosition[2]))
+
+                tmpMrdImg.image_series_index     = iSer
+                tmpMrdImg.image_index            = tmpDset.get('InstanceNumber', 0)
+                tmpMrdImg.slice                  = slice_index.get(slice_locs[iImg], 0)
+                tmpMrdImg.phase                  = phase_index.get(trig_times[iImg], 0)
+
+                # Sequence names repeat across a series, so the parsed result is cached
+                venc = _parse_venc(tmpDset.get('SequenceName', ''))
+                if venc is not None:
+                    tmpMeta['FlowVelocity'] = venc[0]
+                    if venc[1] is not None:
+                        tmpMeta['FlowDirDisplay'] = venc[1]
+
+                if 'ImageComments' in tmpDset:
+                    tmpMeta['ImageComments'] = tmpDset.ImageComments
+
+                tmpMeta['SequenceDescription'] = tmpDset.SeriesDescription
+
+                # Store the complete base64, json-formatted DICOM header so that non-MRD fields can be
+                # recapitulated when generating DICOMs from MRD images
+                tmpMeta['DicomJson'] = dicom_json
+
+                tmpMrdImg.attribute_string = tmpMeta.serialize()
+                pending_writes.append(writer.submit(mrdDset.append_image, image_group, tmpMrdImg))
+                if len(pending_writes) > 16:
+                    pending_writes.popleft().result()
+
+        for write in pending_writes:
+            write.result()
 
     mrdDset.close()
 